@@ -0,0 +1,158 @@
+import os
+import glob
+import numpy as np
+from numpy.typing import NDArray
+from components import MultibodySystem
+from solver import NewtonSolver, drivePoses, applyDrive
+from solveCache import digest, topologyKey, driveKey
+from trajectory import Trajectory, appendNpy, _resizeNpy
+import kinematicsSim as sim
+
+
+#%%
+# Checkpoint Class
+
+class Checkpoint:
+    """
+    Append-only checkpoint directory of a long run.
+
+    Results are appended to named .npy stores (see appendNpy), so a checkpoint only writes the new rows
+    and the stores can be read with np.load while the run is going. The run's state (e.g. the step and
+    the solver's x0) is a small state.npz, replaced atomically after the rows are written. It also holds
+    the number of committed rows of every store, so rows written just before a crash are dropped by recover().
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _store(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def state(self) -> dict | None:
+        """
+        The last committed state, None if nothing was committed
+        """
+        file = os.path.join(self.directory, "state.npz")
+        if not os.path.exists(file):
+            return None
+        with np.load(file) as data:
+            return {name: data[name] for name in data.files}
+
+    def commit(self, rows: dict | None = None, **state) -> None:
+        """
+        Appends {store: rows} and then replaces the state
+        """
+        previous = self.state() or {}
+        counts = {name: value for name, value in previous.items() if name.startswith("rows.")}
+        for name, block in (rows or {}).items():
+            counts[f"rows.{name}"] = appendNpy(self._store(name), block)
+
+        file = os.path.join(self.directory, "state.npz")
+        tmp = file + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **state, **counts)
+        os.replace(tmp, file)
+
+    def read(self, name: str, mmap: bool = True) -> NDArray:
+        """
+        Committed rows of a store, memory mapped read only by default
+        """
+        state = self.state()
+        if state is None or f"rows.{name}" not in state:
+            raise FileNotFoundError(f"No committed rows of {name} in {self.directory}")
+        data = np.load(self._store(name), mmap_mode="r" if mmap else None)
+        return data[:int(state[f"rows.{name}"])]
+
+    def recover(self) -> None:
+        """
+        Trims every store to its committed rows, after a run that died between writing rows and state
+        """
+        state = self.state() or {}
+        for name, count in state.items():
+            if name.startswith("rows."):
+                path = self._store(name[5:])
+                shape = np.load(path, mmap_mode="r").shape
+                _resizeNpy(path, (int(count),) + shape[1:])
+
+    def clear(self) -> None:
+        for f in glob.glob(os.path.join(self.directory, "*.npy")) + glob.glob(os.path.join(self.directory, "state.npz")):
+            os.remove(f)
+
+
+#%%
+# Checkpointed sweep
+
+def checkpointedSim(sys: MultibodySystem, n_steps: int, directory: str, every: int = 256,
+                    solver: NewtonSolver | None = None, restart: bool = False) -> Trajectory:
+    """
+    kinematicsSim that checkpoints into directory every `every` steps and resumes from it.
+    A checkpoint of the same system (topology, hardpoints) and drive is continued from its last step.
+    A different checkpoint in directory raises unless restart=True, which replaces it.
+    The poses are the "trajectory" store, one row per step starting with the initial state,
+    readable while running with Checkpoint(directory).read("trajectory")
+
+    Returns the Trajectory, memory mapped from the store
+    """
+    compiled = sys._compiled()
+    checkpoint = Checkpoint(directory)
+    keys = _keys(sys, n_steps)
+
+    state = checkpoint.state()
+    if state is not None and not restart and not np.array_equal(state["keys"], keys):
+        raise RuntimeError(f"{directory} holds the checkpoint of another system or drive, pass restart=True to replace it.")
+    if state is not None and not restart:
+        checkpoint.recover()
+        start = int(state["step"])
+        compiled.buffer[:compiled.nFree] = state["x0"].reshape(compiled.nFree, 7)
+        compiled.buffer[compiled.nFree:] = state["inputs"]
+    else:
+        checkpoint.clear()
+        start = 0
+        _commitSim(checkpoint, compiled, sys.poses()[None], 0, keys, n_steps, every)
+
+    solver = solver or NewtonSolver(sys, reuse=True, backend=sim.SOLVER)
+    drive = drivePoses(sys, range(n_steps))
+
+    x0 = sys.pack()
+    rows = []
+    for step in range(start, n_steps):
+        applyDrive(sys, drive, step)
+        x0 = solver.solve(x0)
+        rows.append(sys.poses().copy())
+        if len(rows) == every or step == n_steps - 1:
+            _commitSim(checkpoint, compiled, np.array(rows), step + 1, keys, n_steps, every)
+            rows = []
+
+    return Trajectory.load(checkpoint._store("trajectory"), sys)
+
+
+def resumeSim(sys: MultibodySystem, directory: str) -> Trajectory:
+    """
+    Restarts a checkpointedSim from the last checkpoint in directory, sys is the system it was started
+    with (e.g. rebuilt from the same file), the number of steps and checkpoint interval are stored
+    """
+    state = Checkpoint(directory).state()
+    if state is None:
+        raise FileNotFoundError(f"No checkpoint in {directory}")
+    return checkpointedSim(sys, int(state["n_steps"]), directory, int(state["every"]))
+
+
+def _keys(sys: MultibodySystem, n_steps: int) -> NDArray:
+    """
+    Topology, drive and hardpoints of a sweep. Unlike valueKey the current poses are left out,
+    so a system that was part way through the sweep still matches its checkpoint
+    """
+    return np.array([topologyKey(sys), driveKey(sys, n_steps), digest(sys._compiled().frameLocal)])
+
+
+def _commitSim(checkpoint: Checkpoint, compiled, rows: NDArray, step: int, keys: NDArray, n_steps: int,
+               every: int) -> None:
+    """
+    The solver's x0 and the driven bodies' inputs are the last row, the state a resume starts from
+    """
+    last = rows[-1]
+    checkpoint.commit(
+        {"trajectory": rows.reshape(len(rows), -1)}, step=step, keys=keys, n_steps=n_steps, every=every,
+        x0=last[:compiled.nFree].ravel(), inputs=last[compiled.nFree:],
+    )
@@ -0,0 +1,212 @@
+import numpy as np
+from numpy.typing import NDArray
+from scipy.spatial import cKDTree
+from components import MultibodySystem, Body, Frame, quatToMatrix
+
+
+#%%
+# Parts
+
+class Cloud:
+    """
+    A point set attached to a body (Body.attachPoints), e.g. the tire point cloud
+    The KD-tree and bounding box are built once in body coordinates
+    """
+
+    def __init__(self, body: Body, name: str) -> None:
+        self.body = body
+        self.points = body.points[name]
+        self.tree = cKDTree(self.points)
+        self.lower = self.points.min(axis=0)
+        self.upper = self.points.max(axis=0)
+
+        # Spacing of the cloud, the sampling step along capsules
+        d, _ = self.tree.query(self.points, k=2)
+        self.spacing = float(np.max(d[:,1]))
+
+
+class Capsule:
+    """
+    A round bar of the given radius between two frames, e.g. a control arm leg, the tie rod or the coilover
+    The frames may be on different bodies (tie rod, coilover), the segment is rebuilt at every step
+    """
+
+    def __init__(self, frame1: Frame, frame2: Frame, radius: float = 0.0) -> None:
+        self.frame1 = frame1
+        self.frame2 = frame2
+        self.radius = radius
+
+
+def suspensionParts(sys: MultibodySystem, cloud: str = "cloud", armRadius: float = 0.5,
+                    rodRadius: float = 0.375, coilRadius: float = 1.5) -> dict:
+    """
+    Parts of a corner built by buildDoubleWishbone(tire=True) whose upright carries an attached tire cloud,
+    e.g. upright.attachPoints("cloud", upright.pointCloud(100))
+    The control arms are two legs each (like the old ControlArm), the tie rod and coilover are single capsules
+    The tie rod's inner point is looked up by name, so it may sit on the chassis or a steering rack
+    """
+    def frame(name, body):
+        return sys.getFrame(name, body)
+
+    return {
+        "tire": Cloud(sys.getBody("upright"), cloud),
+        "LCA fore": Capsule(frame("chasLowFor", "LCA"), frame("upriLowPnt", "LCA"), armRadius),
+        "LCA aft": Capsule(frame("chasLowAft", "LCA"), frame("upriLowPnt", "LCA"), armRadius),
+        "UCA fore": Capsule(frame("chasUppFor", "UCA"), frame("upriUppPnt", "UCA"), armRadius),
+        "UCA aft": Capsule(frame("chasUppAft", "UCA"), frame("upriUppPnt", "UCA"), armRadius),
+        "tie rod": Capsule(frame("chasTiePnt", None), frame("upriTiePnt", "upright"), rodRadius),
+        "coilover": Capsule(frame("chasCoil", "chassis"), frame("ucaCoil", "UCA"), coilRadius),
+    }
+
+
+#%%
+# Clearance Class
+
+class Clearance:
+    """
+    Minimum clearance between parts over a solved sweep.
+
+    Every pair is a Cloud against a Cloud or a Capsule. The second part is brought into the body
+    coordinates of the cloud, so only a handful of capsule end points (or the query cloud) are transformed
+    per step and the cloud's KD-tree is never rebuilt.
+    Per step the pairs are visited in order of their bounding box distance, a lower bound of their
+    clearance, and the exact distance is only computed while that bound beats the best clearance so far.
+
+    :param parts: {name: Cloud | Capsule}
+    :param pairs: [(cloud name, other name)], defaults to every cloud against every other part
+    """
+
+    def __init__(self, sys: MultibodySystem, parts: dict, pairs: list | None = None) -> None:
+        self.sys = sys
+        self.parts = parts
+        if pairs is None:
+            pairs = [(a, b) for a, pa in parts.items() if isinstance(pa, Cloud)
+                     for b in parts if b != a]
+        for a, b in pairs:
+            if not isinstance(parts[a], Cloud):
+                raise TypeError(f"The first part of a pair must be a Cloud, {a} is not.")
+        self.pairs = pairs
+
+        compiled = sys._compiled()
+        frames = sorted({f for p in parts.values() if isinstance(p, Capsule) for f in (p.frame1, p.frame2)},
+                        key=compiled.frameIndex.get)
+        self._frameIndex = np.array([compiled.frameIndex[f] for f in frames], dtype=int)
+        self._column = {f: i for i, f in enumerate(frames)}
+
+    def check(self, history, steps=None, chunkSize: int = 1024, drive: dict | None = None) -> dict:
+        """
+        Minimum clearance curve over a history (see MultibodySystem.historyPoses, drive is passed to it),
+        negative where parts interfere
+
+        :return: {"clearance": (n,) minimum clearance per step, "pair": (n,) index into pairs of the closest pair,
+                  "pairs": the pairs, "worst": (step, pair, clearance) of the overall minimum}
+        """
+        compiled = self.sys.compiled
+        poses = self.sys.historyPoses(history, drive)
+        steps = np.arange(len(poses))[slice(None) if steps is None else steps]
+
+        clearance = np.full(len(steps), np.inf)
+        closest = np.full(len(steps), -1)
+        for start in range(0, len(steps), chunkSize):
+            chunk = steps[start:start + chunkSize]
+            P = np.asarray(poses[chunk], dtype=float)
+            local = self._localGeometry(compiled, P)
+            bounds = np.stack([self._bound(pair, local) for pair in self.pairs], axis=-1)
+
+            for k in range(len(chunk)):
+                best, which = np.inf, -1
+                for j in np.argsort(bounds[k]):
+                    if bounds[k, j] >= best:
+                        break
+                    d = self._distance(self.pairs[j], local, k, best)
+                    if d < best:
+                        best, which = d, j
+                clearance[start + k] = best
+                closest[start + k] = which
+
+        i = int(np.argmin(clearance))
+        return {
+            "clearance": clearance,
+            "pair": closest,
+            "pairs": self.pairs,
+            "worst": (int(steps[i]), self.pairs[closest[i]], float(clearance[i])),
+        }
+
+    def _localGeometry(self, compiled, P: NDArray) -> dict:
+        """
+        For every cloud: its body rotation and position, and the capsule end points in its body coordinates
+        """
+        F = compiled.framePositions(P, index=self._frameIndex)
+        local = {}
+        for name in {p for pair in self.pairs for p in pair if isinstance(self.parts[p], Cloud)}:
+            body = compiled.bodyIndex[self.parts[name].body]
+            R = quatToMatrix(P[:, body, 3:])
+            r = P[:, body, :3]
+            local[name] = (R, r, np.einsum("nji,nkj->nki", R, F - r[:,None,:]))
+        return local
+
+    def _capsule(self, capsule: Capsule, ends: NDArray) -> tuple:
+        return ends[..., self._column[capsule.frame1], :], ends[..., self._column[capsule.frame2], :]
+
+    def _bound(self, pair: tuple, local: dict) -> NDArray:
+        """
+        Bounding box distance between the two parts for every step of the chunk, a lower bound of the clearance
+        A capsule's box is its segment's inflated by the radius. Where that overlaps the cloud's box the bound
+        is the segment's box distance less the radius instead, which may be negative like the clearance
+        """
+        a, b = self.parts[pair[0]], self.parts[pair[1]]
+        R, r, ends = local[pair[0]]
+        if isinstance(b, Capsule):
+            e1, e2 = self._capsule(b, ends)
+            lower, upper = np.minimum(e1, e2), np.maximum(e1, e2)
+        else:
+            # Box around the other cloud's box corners, brought into a's coordinates
+            Rb, rb, _ = local[pair[1]]
+            corners = np.stack(np.meshgrid(*zip(b.lower, b.upper), indexing="ij"), axis=-1).reshape(-1, 3)
+            world = rb[:,None,:] + np.einsum("nij,kj->nki", Rb, corners)
+            inA = np.einsum("nji,nkj->nki", R, world - r[:,None,:])
+            lower, upper = inA.min(axis=1), inA.max(axis=1)
+        gap = np.maximum(np.maximum(a.lower - upper, lower - a.upper), 0)
+        if isinstance(b, Cloud):
+            return np.linalg.norm(gap, axis=-1)
+
+        inflated = np.linalg.norm(np.maximum(gap - b.radius, 0), axis=-1)
+        return np.where(inflated > 0, inflated, np.linalg.norm(gap, axis=-1) - b.radius)
+
+    def _distance(self, pair: tuple, local: dict, k: int, best: float) -> float:
+        """
+        Exact clearance of a pair at step k of the chunk, or anything >= best if it cannot beat best
+        """
+        a, b = self.parts[pair[0]], self.parts[pair[1]]
+        R, r, ends = local[pair[0]]
+        if isinstance(b, Capsule):
+            e1, e2 = self._capsule(b, ends[k])
+            return _segmentDistance(a, e1, e2, best + b.radius) - b.radius
+
+        Rb, rb, _ = local[pair[1]]
+        points = (b.points @ Rb[k].T + rb[k] - r[k]) @ R[k]
+        d, _ = a.tree.query(points, distance_upper_bound=best)
+        return float(np.min(d))
+
+
+def _segmentDistance(cloud: Cloud, e1: NDArray, e2: NDArray, best: float) -> float:
+    """
+    Exact distance from a cloud to the segment e1-e2
+    Samples of the segment spaced h apart bound the distance to [min - h/2, min], the exact value is then
+    the closest of the cloud points within min + h/2 of a sample
+    """
+    h = cloud.spacing
+    d = e2 - e1
+    n = int(np.ceil(np.linalg.norm(d) / h)) + 1
+    samples = e1 + np.linspace(0, 1, n)[:,None] * d
+    h = np.linalg.norm(d) / max(n - 1, 1)
+
+    dist, _ = cloud.tree.query(samples)
+    upper = np.min(dist)
+    if upper - h/2 >= best:
+        return upper - h/2
+
+    candidates = np.unique(np.concatenate(cloud.tree.query_ball_point(samples, upper + h/2)).astype(int))
+    P = cloud.points[candidates]
+    t = np.clip((P - e1) @ d / max(d @ d, 1e-300), 0, 1)
+    return float(np.min(np.linalg.norm(P - e1 - t[:,None] * d, axis=-1)))
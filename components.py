@@ -1,7 +1,114 @@
+from __future__ import annotations
 import numpy as np
 from numpy.typing import NDArray
 import copy
-from scipy.spatial.transform import Rotation
+from scipy import sparse
+
+
+#%%
+# Quaternion helpers
+# Quaternions are stored scalar first, q = [w, x, y, z], so [1,0,0,0] is the identity
+
+def skew(v: NDArray) -> NDArray:
+    """
+    Cross product matrix of v, such that skew(v) @ s = v x s
+    Works on stacks of vectors, (...,3) -> (...,3,3)
+    """
+    v = np.asarray(v, dtype=float)
+    S = np.zeros(v.shape[:-1] + (3, 3))
+    S[...,0,1] = -v[...,2]
+    S[...,0,2] = v[...,1]
+    S[...,1,0] = v[...,2]
+    S[...,1,2] = -v[...,0]
+    S[...,2,0] = -v[...,1]
+    S[...,2,1] = v[...,0]
+    return S
+
+# R is quadratic in q, so R.ravel() = (q q^T).ravel() @ _QUAT_TO_MATRIX
+# Rows are the index 4*i + j of q_i q_j, columns the index 3*row + col of R
+_QUAT_TO_MATRIX = np.zeros((16, 9))
+for _entry, _terms in enumerate([
+        [(0,0,1), (1,1,1), (2,2,-1), (3,3,-1)], [(1,2,2), (0,3,-2)], [(1,3,2), (0,2,2)],
+        [(1,2,2), (0,3,2)], [(0,0,1), (1,1,-1), (2,2,1), (3,3,-1)], [(2,3,2), (0,1,-2)],
+        [(1,3,2), (0,2,-2)], [(2,3,2), (0,1,2)], [(0,0,1), (1,1,-1), (2,2,-1), (3,3,1)]]):
+    for _i, _j, _c in _terms:
+        _QUAT_TO_MATRIX[4*_i + _j, _entry] = _c
+
+def quatToMatrix(q: NDArray) -> NDArray:
+    """
+    Rotation matrix of a scalar first quaternion, (...,4) -> (...,3,3)
+    Uses the homogeneous form R = (w^2 - v.v) I + 2 v v^T + 2 w [v]x, which is
+    only a pure rotation when |q| = 1 (enforced by Body.residual, or kept by CompiledSystem.retract)
+    """
+    q = np.asarray(q, dtype=float)
+    qq = (q[...,:,None] * q[...,None,:]).reshape(q.shape[:-1] + (16,))
+    return (qq @ _QUAT_TO_MATRIX).reshape(q.shape[:-1] + (3, 3))
+
+def quatMultiply(a: NDArray, b: NDArray) -> NDArray:
+    """
+    Hamilton product a * b, the rotation b followed by a. Works on stacks, (...,4)
+    """
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+    w1, v1 = a[...,:1], a[...,1:]
+    w2, v2 = b[...,:1], b[...,1:]
+    return np.concatenate([w1*w2 - np.sum(v1*v2, axis=-1, keepdims=True),
+                           w1*v2 + w2*v1 + np.cross(v1, v2)], axis=-1)
+
+def quatFromAxisAngle(axis: NDArray | list, angle: NDArray | float) -> NDArray:
+    """
+    Quaternion of a right handed rotation by angle (radians) about axis, (...,) angles -> (...,4)
+    """
+    axis = np.asarray(axis, dtype=float)
+    axis = axis / np.linalg.norm(axis, axis=-1, keepdims=True)
+    half = 0.5 * np.asarray(angle, dtype=float)[...,None]
+    return np.concatenate([np.cos(half), np.sin(half) * axis], axis=-1)
+
+def quatFromRotationVector(v: NDArray | list) -> NDArray:
+    """
+    Quaternion of the rotation vector v (axis times angle in radians), the exponential map, (...,3) -> (...,4)
+    Exact for small and zero angles, no axis is divided out
+    """
+    v = np.asarray(v, dtype=float)
+    angle = np.linalg.norm(v, axis=-1, keepdims=True)
+    # sin(angle/2) / angle, np.sinc(x) = sin(pi x) / (pi x)
+    return np.concatenate([np.cos(angle / 2), 0.5 * np.sinc(angle / (2 * np.pi)) * v], axis=-1)
+
+def quatTangent(q: NDArray) -> NDArray:
+    """
+    Derivative of quatFromRotationVector(w) * q with respect to a global rotation vector w at w = 0,
+    the 4x3 matrix E(q) such that dq = E(q) @ w for a small rotation w about the current orientation
+    Works on stacks, (...,4) -> (...,4,3)
+    """
+    q = np.asarray(q, dtype=float)
+    E = np.empty(q.shape[:-1] + (4, 3))
+    E[...,0,:] = -0.5 * q[...,1:]
+    E[...,1:,:] = 0.5 * (q[...,0,None,None] * np.eye(3) - skew(q[...,1:]))
+    return E
+
+# d(R s)/dq is bilinear in q and s, so it is (q s^T).ravel() @ _QUAT_POSITION reshaped to 3x4
+# Rows are the index 3*b + j of q_b s_j, columns the index 4*i + k of d(R s)_i/dq_k
+_QUAT_POSITION = np.zeros((12, 12))
+for _b in range(4):
+    for _j in range(3):
+        for _i in range(3):
+            for _k in range(4):
+                _QUAT_POSITION[3*_b + _j, 4*_i + _k] = (_QUAT_TO_MATRIX[4*_k + _b, 3*_i + _j]
+                                                        + _QUAT_TO_MATRIX[4*_b + _k, 3*_i + _j])
+
+def positionJacobian(q: NDArray, s: NDArray) -> NDArray:
+    """
+    Derivative of the global position r + R(q) @ s with respect to the body
+    coordinates [r, q]. Returns a 3x7 matrix, or (...,3,7) for stacks of q and s
+    """
+    q = np.asarray(q, dtype=float)
+    s = np.asarray(s, dtype=float)
+    qs = q[...,:,None] * s[...,None,:]
+    batch = qs.shape[:-2]
+
+    J = np.zeros(batch + (3, 7))
+    J[...,:,:3] = np.eye(3)
+    J[...,:,3:] = (qs.reshape(batch + (12,)) @ _QUAT_POSITION).reshape(batch + (3, 4))
+    return J
 
 
 #%%
@@ -12,20 +119,60 @@ class Body:
     def __init__(self, name: str, r: NDArray | list, q: NDArray | list, free=False) -> None:
         self.name = name
 
-        self.r = np.asarray(r, dtype=float)
-        self.q = np.asarray(q, dtype=float)
+        self._bound = False
+        self.r = r
+        self.q = q
         self.free = free
         
         # Create a variable to store the frames associated to the body
         self.frames = [Frame([0,0,0])] # Always set the first frame as the origin
+        self.frames[0].body = self
         self.motion = None
+        self.points = {}
+
+    # Once the system is compiled r and q are views into its pose buffer,
+    # so assigning to them writes in place instead of rebinding
+    @property
+    def r(self) -> NDArray:
+        return self._r
+
+    @r.setter
+    def r(self, value: NDArray | list) -> None:
+        if self._bound:
+            self._r[...] = value
+        else:
+            self._r = np.asarray(value, dtype=float)
+
+    @property
+    def q(self) -> NDArray:
+        return self._q
+
+    @q.setter
+    def q(self, value: NDArray | list) -> None:
+        if self._bound:
+            self._q[...] = value
+        else:
+            self._q = np.asarray(value, dtype=float)
 
     def addFrame(self, frame: Frame) -> None:
         for f in frame:
             f.body = self
             self.frames.append(f)
 
+    def attachPoints(self, name: str, points: NDArray | list) -> None:
+        """
+        Attaches a named set of points (k, 3), stored once in body coordinates
+        e.g. tire.attachPoints("cloud", tire.pointCloud(200)). See MultibodySystem.transformPoints
+        """
+        points = np.array(points, dtype=float).reshape(-1, 3)
+        points.flags.writeable = False
+        self.points[name] = points
+
     def setMotion(self, motion) -> None:
+        """
+        Drives the body with motion, a callable step -> (r, q) like heave_motion or a MotionProfile
+        of poses sampled over the sweep (see motion.py)
+        """
         self.motion = motion
         self.free = False
 
@@ -37,10 +184,25 @@ class Body:
 
 class Frame:
 
-    def __init__(self, r_local: NDArray | list) -> None:
-        self.r_local = np.asarray(r_local, dtype=float)
+    def __init__(self, r_local: NDArray | list, designVariable: bool = False, name: str | None = None) -> None:
+        self._bound = False
+        self.r_local = r_local
+        self.designVariable = designVariable
+        self.name = name
         self.body = None
 
+    @property
+    def r_local(self) -> NDArray:
+        return self._r_local
+
+    @r_local.setter
+    def r_local(self, value: NDArray | list) -> None:
+        # Once the system is compiled r_local is a row of its frame table, so write in place
+        if self._bound:
+            self._r_local[...] = value
+        else:
+            self._r_local = np.asarray(value, dtype=float)
+
     def globalPosition(self) -> NDArray:
 
         if self.body is None:
@@ -48,17 +210,148 @@ class Frame:
                 "Frame is not attached to a body."
             )
     
-        R = Rotation.from_quat(self.body.q).as_matrix()
+        R = quatToMatrix(self.body.q)
         return self.body.r + R @ self.r_local
 
+#%%
+# Tire Class
+
+def torusSupport(d: NDArray, center: NDArray, axis: NDArray, c: float, a: float, b: float) -> NDArray:
+    """
+    Support point of an elliptical torus, the surface point furthest along the direction d
+    The torus revolves an ellipse (semi axes a radial and b axial, centered c from the axis) about axis through center
+    With u the unit radial direction of d, alpha = d.u and beta = d.axis the point is
+        center + c u + (a^2 alpha u + b^2 beta axis) / sqrt(a^2 alpha^2 + b^2 beta^2)
+    Works on stacks, d (...,3) with center, axis (...,3) and c, a, b broadcasting against the stack
+    """
+    d = np.asarray(d, dtype=float)
+    c, a, b = (np.asarray(x, dtype=float)[...,None] for x in (c, a, b))
+    beta = np.sum(d * axis, axis=-1)[...,None]
+    radial = d - beta * axis
+    alpha = np.linalg.norm(radial, axis=-1)[...,None]
+    u = radial / np.where(alpha > 0, alpha, 1)
+    return center + c * u + (a**2 * alpha * u + b**2 * beta * axis) / np.sqrt(a**2 * alpha**2 + b**2 * beta**2)
+
+
+class Tire(Body):
+    """
+    A body carrying a tire, modelled as an elliptical torus (the shape of the old Tire.pointCloud)
+    ALL UNITS IN in.
+
+    The torus is centered at a frame of the body and spins about axis (body coordinates), so the
+    upright can be the tire body with the tire at its wheelCenter frame. center is a Frame, which is
+    added to the body, or local coordinates for a new one.
+    The contact point (lowest point) is found analytically from the torus support function,
+    the point cloud is only built, once per resolution, when something needs to draw it.
+    """
+
+    def __init__(self, name: str, r: NDArray | list, q: NDArray | list, OD: float, ID: float, width: float,
+                 center: Frame | NDArray | list = [0,0,0], axis: NDArray | list = [0,0,1], free=False) -> None:
+        super().__init__(name, r, q, free)
+        self.OD = OD
+        self.ID = ID
+        self.width = width
+        self.centerFrame = center if isinstance(center, Frame) else Frame(center)
+        self.addFrame([self.centerFrame])
+        self.axis = np.asarray(axis, dtype=float) / np.linalg.norm(axis)
+
+        # Ellipse of the tire section: its center distance from the axis and its radial / axial semi axes
+        self.c = (OD/2 + ID/2) / 2
+        self.a = OD/2 - self.c
+        self.b = width/2
+        self._clouds = {}
+
+    @property
+    def center(self) -> NDArray:
+        return self.centerFrame.r_local
+
+    def torusParameters(self) -> NDArray:
+        """
+        [axis, c, a, b], the torus relative to its center frame
+        """
+        return np.concatenate([self.axis, [self.c, self.a, self.b]])
+
+    def supportPoint(self, direction: NDArray | list) -> NDArray:
+        """
+        Body coordinates of the tire surface point furthest along a direction given in body coordinates
+        """
+        return torusSupport(direction, self.center, self.axis, self.c, self.a, self.b)
+
+    def contactLocal(self, normal: NDArray | list = [0,0,1]) -> NDArray:
+        """
+        Body coordinates of the lowest point of the tire with respect to a ground plane with the given global normal
+        """
+        R = quatToMatrix(self.q)
+        return self.supportPoint(-R.T @ np.asarray(normal, dtype=float))
+
+    def contactPoint(self, normal: NDArray | list = [0,0,1]) -> NDArray:
+        """
+        Global position of the lowest point of the tire
+        """
+        return self.r + quatToMatrix(self.q) @ self.contactLocal(normal)
+
+    def pointCloud(self, n: int = 100) -> NDArray:
+        """
+        pointCloud returns an (n^2, 3) point cloud of the tire in body coordinates
+        Revolves the section ellipse about the axis. Cached per resolution
+        """
+        if n not in self._clouds:
+            angle = np.linspace(0, 2*np.pi, n)
+            phi, theta = angle[None,:], angle[:,None]
+            radial = self.a * np.cos(phi) + self.c
+            canonical = np.stack([radial * np.cos(theta), radial * np.sin(theta),
+                                  np.broadcast_to(self.b * np.sin(phi), (n, n))], axis=-1).reshape(-1, 3)
+
+            # Basis with the revolution axis as its third column
+            e1 = np.cross(self.axis, [1,0,0] if abs(self.axis[0]) < 0.9 else [0,1,0])
+            e1 /= np.linalg.norm(e1)
+            basis = np.stack([e1, np.cross(self.axis, e1), self.axis], axis=-1)
+
+            self._clouds[n] = canonical @ basis.T
+        return self._clouds[n] + self.center
+
+    def globalPointCloud(self, n: int = 100) -> NDArray:
+        """
+        The point cloud placed at the body's current pose
+        """
+        return self.r + self.pointCloud(n) @ quatToMatrix(self.q).T
+
 #%%
 # Joint Classes
 
-class SphericalJoint:
+class Joint:
+    """
+    Base class for the joints between two frames.
+
+    nEquations is the number of residual rows of a single joint.
+    For the compiled system every joint type evaluates all of its joints at once:
+    batchResidual / batchJacobian receive the gathered frame positions (g.p1, g.p2),
+    body quaternions (g.q1, g.q2), local offsets (g.s1, g.s2) and frame position jacobians (g.J1, g.J2),
+    each with a leading joint axis, and params, the stacked parameters() of the joints.
+    batchJacobian returns the blocks for body1 and body2, each (..., n_joints, nEquations, 7)
+    batchOffsetJacobian returns the derivatives with respect to the frames' local offsets s1 and s2,
+    each (..., n_joints, nEquations, 3), and additionally receives the body rotations (g.R1, g.R2)
+    """
+    nEquations = 0
 
     def __init__(self, frame1: Frame, frame2: Frame) -> None:
         self.frame1 = frame1
         self.frame2 = frame2
+
+    def parameters(self) -> NDArray:
+        return np.zeros(0)
+
+    @classmethod
+    def batchOffsetJacobian(cls, g, params: NDArray) -> tuple:
+        # A joint that only sees its frames through their global positions p = r + R s has
+        # dPhi/ds = dPhi/dp R, and dPhi/dp is the r block of its jacobian
+        block1, block2 = cls.batchJacobian(g, params)
+        return block1[...,:3] @ g.R1, block2[...,:3] @ g.R2
+
+
+class SphericalJoint(Joint):
+
+    nEquations = 3
     
     def residual(self) -> NDArray:
 
@@ -69,53 +362,530 @@ class SphericalJoint:
 
         return disp_residual.flatten()
 
+    @staticmethod
+    def batchResidual(g, params: NDArray) -> NDArray:
+        return g.p2 - g.p1
+
+    @staticmethod
+    def batchJacobian(g, params: NDArray) -> tuple:
+        return -g.J1, g.J2
+
 
-class RevoluteJoint:
+class RevoluteJoint(Joint):
+    """
+    Hinge between two frames: the frames coincide and the axis AoR of the two bodies stays aligned
+    AoR is given in the assembly pose, where every body sits at the origin (the convention used by the
+    builders), so it is the axis in both bodies' coordinates.
+    The alignment is two conditions: the axis of body2 has no component along the two directions of
+    body1 normal to its axis, (R1 b) . (R2 a) = (R1 c) . (R2 a) = 0
+    """
+
+    nEquations = 5
 
     def __init__(self, frame1, frame2, AoR: NDArray | list) -> None:
         self.frame1 = frame1
         self.frame2 = frame2
         self.AoR = np.asarray(AoR, dtype=float)
 
+    def axes(self) -> NDArray:
+        """
+        Rows a, b, c: the unit axis and two unit directions normal to it and to each other
+        """
+        a = self.AoR / np.linalg.norm(self.AoR)
+        b = np.cross(a, [1,0,0] if abs(a[0]) < 0.9 else [0,1,0])
+        b /= np.linalg.norm(b)
+        return np.stack([a, b, np.cross(a, b)])
+
     def residual(self) -> NDArray:
         p1 = self.frame1.globalPosition()
         p2 = self.frame2.globalPosition()
+        a, b, c = self.axes()
+        R1 = quatToMatrix(self.frame1.body.q)
+        R2 = quatToMatrix(self.frame2.body.q)
 
-        body1 = self.frame1.body
-        body2 = self.frame2.body
+        axis2 = R2 @ a
+        return np.concatenate([p2 - p1, [(R1 @ b) @ axis2, (R1 @ c) @ axis2]])
 
-        q1 = body1.q
-        q2 = body2.q
+    def parameters(self) -> NDArray:
+        return self.axes()
 
-        disp_residual = (p2 - p1).flatten()
+    @staticmethod
+    def _directions(g, params: NDArray) -> tuple:
+        # Global axis of body2 and normals of body1, each (..., n, 3)
+        axis2 = np.einsum("...nij,nj->...ni", quatToMatrix(g.q2), params[:,0])
+        normal1 = np.einsum("...nij,nkj->...nki", quatToMatrix(g.q1), params[:,1:])
+        return axis2, normal1
 
-        rot_residual = np.array([
-            q1[1]/self.AoR[0] - q1[2]/self.AoR[1], 
-            q1[2]/self.AoR[1] - q1[3]/self.AoR[2], 
-            q1[1]/self.AoR[0] - q1[3]/self.AoR[3],
-            q2[1]/self.AoR[0] - q2[2]/self.AoR[1], 
-            q2[2]/self.AoR[1] - q2[3]/self.AoR[2], 
-            q2[1]/self.AoR[0] - q2[3]/self.AoR[3],
-        ])
+    @staticmethod
+    def batchResidual(g, params: NDArray) -> NDArray:
+        axis2, normal1 = RevoluteJoint._directions(g, params)
+        align = np.einsum("...nki,...ni->...nk", normal1, axis2)
+        return np.concatenate([g.p2 - g.p1, align], axis=-1)
 
-        return np.append(disp_residual, rot_residual).flatten()
+    @staticmethod
+    def batchJacobian(g, params: NDArray) -> tuple:
+        axis2, normal1 = RevoluteJoint._directions(g, params)
+        # d(R s)/dq of the axis directions, (..., n, k, 3, 4)
+        dNormal1 = positionJacobian(g.q1[...,None,:], params[:,1:])[...,3:]
+        dAxis2 = positionJacobian(g.q2, params[:,0])[...,3:]
 
+        block1 = np.zeros(g.J1.shape[:-2] + (5, 7))
+        block1[...,:3,:] = -g.J1
+        block1[...,3:,3:] = np.einsum("...ni,...nkij->...nkj", axis2, dNormal1)
 
-# WIP:
-# class CartesianJoint:
+        block2 = np.zeros(g.J2.shape[:-2] + (5, 7))
+        block2[...,:3,:] = g.J2
+        block2[...,3:,3:] = np.einsum("...nki,...nij->...nkj", normal1, dAxis2)
+        return block1, block2
 
-#     def __init__(self, frame1: Frame, frame2: Frame, fixedAxis= NDArray | list) -> None:
-#         self.frame1 = frame1
-#         self.frame2 = frame2
-#         self.fixedAxis = fixedAxis
 
-#     def residual(self) -> NDArray:
-#         p1 = self.frame1.globalPosition()
-#         p2 = self.frame2.globalPosition()
+class CartesianJoint(Joint):
+    """
+    Locks the displacement between two frames along a single global axis
+    """
 
-#         disp_residual = 
+    nEquations = 1
 
-#         return np.array([p2[2] - p1[2]]).flatten() # global z axis is locked
+    def __init__(self, frame1: Frame, frame2: Frame, fixedAxis: NDArray | list = [0,0,1]) -> None:
+        self.frame1 = frame1
+        self.frame2 = frame2
+        self.fixedAxis = np.asarray(fixedAxis, dtype=float)
+
+    def residual(self) -> NDArray:
+        p1 = self.frame1.globalPosition()
+        p2 = self.frame2.globalPosition()
+
+        return np.array([self.fixedAxis @ (p2 - p1)])
+
+    def parameters(self) -> NDArray:
+        return self.fixedAxis
+
+    @staticmethod
+    def batchResidual(g, params: NDArray) -> NDArray:
+        return np.sum(params * (g.p2 - g.p1), axis=-1)[...,None]
+
+    @staticmethod
+    def batchJacobian(g, params: NDArray) -> tuple:
+        block1 = -np.einsum("ni,...nij->...nj", params, g.J1)[...,None,:]
+        block2 = np.einsum("ni,...nij->...nj", params, g.J2)[...,None,:]
+        return block1, block2
+
+
+class DistanceJoint(Joint):
+    """
+    Keeps the distance between two frames constant, like a rod with a ball joint at each end
+    If no length is given it is the distance between the frames in the assembly pose, where every
+    body sits at the origin (the convention used by the builders). It then follows the frames' r_local
+    """
+
+    nEquations = 1
+
+    def __init__(self, frame1: Frame, frame2: Frame, length: float | None = None) -> None:
+        self.frame1 = frame1
+        self.frame2 = frame2
+        self.length = length
+
+    def currentLength(self) -> float:
+        if self.length is None:
+            return np.linalg.norm(self.frame2.r_local - self.frame1.r_local)
+        return self.length
+
+    def residual(self) -> NDArray:
+        p1 = self.frame1.globalPosition()
+        p2 = self.frame2.globalPosition()
+
+        return np.array([np.linalg.norm(p2 - p1) - self.currentLength()])
+
+    def parameters(self) -> NDArray:
+        # nan marks a length that follows the assembly pose
+        return np.array(np.nan if self.length is None else self.length, dtype=float)
+
+    @staticmethod
+    def batchResidual(g, params: NDArray) -> NDArray:
+        d = np.linalg.norm(g.p2 - g.p1, axis=-1)
+        L = np.where(np.isnan(params), np.linalg.norm(g.s2 - g.s1, axis=-1), params)
+        return (d - L)[...,None]
+
+    @staticmethod
+    def batchJacobian(g, params: NDArray) -> tuple:
+        d = g.p2 - g.p1
+        u = d / np.linalg.norm(d, axis=-1)[...,None]
+        block1 = -np.einsum("...ni,...nij->...nj", u, g.J1)[...,None,:]
+        block2 = np.einsum("...ni,...nij->...nj", u, g.J2)[...,None,:]
+        return block1, block2
+
+    @classmethod
+    def batchOffsetJacobian(cls, g, params: NDArray) -> tuple:
+        D1, D2 = super().batchOffsetJacobian(g, params)
+        # A length that follows the assembly pose also depends on the offsets directly
+        d = g.s2 - g.s1
+        dL = np.where(np.isnan(params)[:,None], d / np.linalg.norm(d, axis=-1)[...,None], 0)
+        return D1 + dL[...,None,:], D2 - dL[...,None,:]
+
+
+class GroundContact(Joint):
+    """
+    Keeps the lowest point of a Tire on the ground plane through a frame of the ground body
+    frame1 is the tire's center frame, the contact point is found analytically from the tire pose
+    at each evaluation (O(1), no point cloud)
+    """
+
+    nEquations = 1
+
+    def __init__(self, tire: Tire, ground: Frame, normal: NDArray | list = [0,0,1]) -> None:
+        self.frame1 = tire.centerFrame
+        self.frame2 = ground
+        self.tire = tire
+        self.normal = np.asarray(normal, dtype=float) / np.linalg.norm(normal)
+
+    def residual(self) -> NDArray:
+        p2 = self.frame2.globalPosition()
+        return np.array([self.normal @ (self.tire.contactPoint(self.normal) - p2)])
+
+    def parameters(self) -> NDArray:
+        # [normal, axis, c, a, b]
+        return np.concatenate([self.normal, self.tire.torusParameters()])
+
+    @staticmethod
+    def _contact(g, params: NDArray) -> tuple:
+        n = params[:,:3]
+        R = quatToMatrix(g.q1)
+        # Support point relative to the center frame, at p1
+        s = torusSupport(-np.einsum("...nji,nj->...ni", R, n), 0, params[:,3:6],
+                         params[:,6], params[:,7], params[:,8])
+        p = g.p1 + np.einsum("...nij,...nj->...ni", R, s)
+        return n, s, p
+
+    @staticmethod
+    def batchResidual(g, params: NDArray) -> NDArray:
+        n, _, p = GroundContact._contact(g, params)
+        return np.sum(n * (p - g.p2), axis=-1)[...,None]
+
+    @staticmethod
+    def batchJacobian(g, params: NDArray) -> tuple:
+        n, s, _ = GroundContact._contact(g, params)
+        # The contact point is held at its body coordinates. It slides over the surface as the body turns,
+        # but that motion is tangent to the ground, so this is the exact derivative of the contact height
+        block1 = np.einsum("ni,...nij->...nj", n, positionJacobian(g.q1, g.s1 + s))[...,None,:]
+        block2 = -np.einsum("ni,...nij->...nj", n, g.J2)[...,None,:]
+        return block1, block2
+
+
+#%%
+# Compiled System Class
+
+class JointGroup:
+    """
+    All the joints of a single type, with the gather indices into the compiled tables
+    rows: (n, nEquations) residual rows of each joint
+    f1, f2: frame table indices. b1, b2: body table indices
+    """
+
+    def __init__(self, jointType: type, joints: list, rows: NDArray, frameIndex: dict, bodyIndex: dict) -> None:
+        self.jointType = jointType
+        self.joints = joints
+        self.rows = rows
+        self.f1 = np.array([frameIndex[j.frame1] for j in joints], dtype=int)
+        self.f2 = np.array([frameIndex[j.frame2] for j in joints], dtype=int)
+        self.b1 = np.array([bodyIndex[j.frame1.body] for j in joints], dtype=int)
+        self.b2 = np.array([bodyIndex[j.frame2.body] for j in joints], dtype=int)
+        self.params = np.stack([j.parameters() for j in joints])
+
+
+class Gather:
+    """
+    The per joint arrays handed to Joint.batchResidual / batchJacobian
+    """
+
+    def __init__(self, **arrays) -> None:
+        self.__dict__.update(arrays)
+
+
+class CompiledSystem:
+    """
+    Flattened, array based form of a MultibodySystem used to evaluate the residual and jacobian
+    with a handful of batched numpy operations instead of per joint python calls.
+
+    Bodies are ordered with the free bodies first, so the pose table is (n_bodies, 7) rows of [r, q]
+    and the first nState columns of the full jacobian are the packed state. The remaining columns
+    belong to the prescribed (non-free) bodies.
+    buffer is the system's pose table. Every body's r and q are views into it, and state is the
+    view of its first nState entries, so the packed state vector never has to be gathered or scattered.
+    Every frame is flattened into a struct of arrays table: frameBody (body index) and frameLocal (offset).
+    The frames' r_local become views into frameLocal, so editing a frame updates the compiled table.
+
+    All evaluation methods accept stacks of poses (..., n_bodies, 7), and frameLocal (..., n_frames, 3)
+    can be overridden with a stack as well.
+
+    With bind=False the bodies and frames keep their own arrays and the compiled form only holds copies,
+    e.g. for a sub-problem of a larger system, and only of the frames its joints use (so sub-problems that
+    share a body with other frames, like the corners of a vehicle on one chassis, compile alike).
+    free overrides which bodies are solved for.
+
+    Rotation vector formulation: instead of the 7 pose coordinates with a normalization equation per
+    body, a solver can step in the 6 dimensional tangent space of every free body, a translation and a
+    global rotation vector about the current orientation (see tangentJacobian and retract).
+    The quaternions then stay unit length by construction and only the nConstraints joint rows are solved.
+    """
+
+    def __init__(self, system: MultibodySystem, bind: bool = True, free: list | None = None) -> None:
+        isFree = (lambda b: b.free) if free is None else (lambda b: b in free)
+        prescribed = [b for b in system.bodies if not isFree(b)]
+        free = [b for b in system.bodies if isFree(b)]
+        self.bodies = free + prescribed
+        self.bodyIndex = {b: i for i, b in enumerate(self.bodies)}
+        self.nFree = len(free)
+        self.nState = 7 * self.nFree
+        self.nColumns = 7 * len(self.bodies)
+
+        # Contiguous pose buffer, the bodies' r and q become views into it
+        self.buffer = np.array([np.concatenate([b.r, b.q]) for b in self.bodies], dtype=float).reshape(-1, 7)
+        for i, b in enumerate(self.bodies if bind else []):
+            b._r = self.buffer[i,:3]
+            b._q = self.buffer[i,3:]
+            b._bound = True
+        self.state = self.buffer.reshape(-1)[:self.nState]
+
+        # Frame table
+        used = set(f for j in system.joints for f in (j.frame1, j.frame2))
+        self.frames = [f for b in self.bodies for f in b.frames if bind or f in used]
+        self.frameIndex = {f: i for i, f in enumerate(self.frames)}
+        self.frameBody = np.array([self.bodyIndex[f.body] for f in self.frames], dtype=int)
+        self.frameLocal = np.array([f.r_local for f in self.frames], dtype=float).reshape(-1, 3)
+        for i, f in enumerate(self.frames if bind else []):
+            f._r_local = self.frameLocal[i]
+            f._bound = True
+
+        for joint in system.joints:
+            for f in (joint.frame1, joint.frame2):
+                if f not in self.frameIndex:
+                    raise RuntimeError(
+                        "Joint frame is not attached to a body of the system."
+                    )
+
+        # Group the joints by type, keeping the residual row order of the joint list
+        byType = {}
+        row = 0
+        for joint in system.joints:
+            m = joint.nEquations
+            byType.setdefault(type(joint), []).append((joint, np.arange(row, row + m)))
+            row += m
+
+        self.groups = [
+            JointGroup(jointType, [j for j, _ in items], np.stack([r for _, r in items]),
+                       self.frameIndex, self.bodyIndex)
+            for jointType, items in byType.items()
+        ]
+
+        # Quaternion normalization rows of the free bodies
+        self.nConstraints = row
+        self.nTangent = 6 * self.nFree
+        self.normRows = np.arange(row, row + self.nFree)
+        self.nResiduals = row + self.nFree
+
+        self._buildPattern()
+
+    def _buildPattern(self) -> None:
+        """
+        Fixed sparsity pattern of the full jacobian, in the order jacobianData produces its entries
+        """
+        rows, cols = [], []
+        dof = np.arange(7)
+        for grp in self.groups:
+            for b in (grp.b1, grp.b2):
+                r = np.broadcast_to(grp.rows[:,:,None], grp.rows.shape + (7,))
+                c = np.broadcast_to(7*b[:,None,None] + dof, grp.rows.shape + (7,))
+                rows.append(r.ravel())
+                cols.append(c.ravel())
+        rows.append(np.repeat(self.normRows, 4))
+        cols.append((7*np.arange(self.nFree)[:,None] + np.arange(3, 7)).ravel())
+
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        linear = rows * self.nColumns + cols
+
+        # Entries that land on the same slot (a joint between two frames of one body) are summed
+        unique, inverse = np.unique(linear, return_inverse=True)
+        if len(unique) == len(linear):
+            self._order = np.argsort(linear)
+            self._merge = None
+        else:
+            self._order = None
+            self._merge = sparse.csr_matrix(
+                (np.ones(len(linear)), (np.arange(len(linear)), inverse)), shape=(len(linear), len(unique))
+            )
+
+        self.linearIndex = unique
+        uRows, uCols = np.divmod(unique, self.nColumns)
+        self._csr = self._csrStructure(uRows, uCols, np.ones(len(unique), dtype=bool), self.nColumns)
+        self._freeMask = uCols < self.nState
+        self._csrFree = self._csrStructure(uRows, uCols, self._freeMask, self.nState)
+
+        # Tangent pattern: a joint row touches all 7 pose columns of a body, which are consecutive
+        # entries of the pattern, so every (row, free body) pair becomes 6 tangent columns
+        entries = np.flatnonzero(self._freeMask & (uRows < self.nConstraints))
+        self._tangentGather = entries.reshape(-1, 7)
+        self._tangentBody = uCols[entries[::7]] // 7
+        tRows = np.repeat(uRows[entries[::7]], 6)
+        tCols = (6*self._tangentBody[:,None] + np.arange(6)).ravel()
+        indptr = np.zeros(self.nConstraints + 1, dtype=np.int32)
+        np.cumsum(np.bincount(tRows, minlength=self.nConstraints), out=indptr[1:])
+        self._csrTangent = (tCols.astype(np.int32), indptr, (self.nConstraints, self.nTangent))
+
+    def _csrStructure(self, rows: NDArray, cols: NDArray, mask: NDArray, nColumns: int) -> tuple:
+        indptr = np.zeros(self.nResiduals + 1, dtype=np.int32)
+        np.cumsum(np.bincount(rows[mask], minlength=self.nResiduals), out=indptr[1:])
+        return cols[mask].astype(np.int32), indptr, (self.nResiduals, nColumns)
+
+    def _frameTerms(self, poses: NDArray, frameLocal: NDArray | None, index: NDArray | None = None) -> tuple:
+        s = self.frameLocal if frameLocal is None else frameLocal
+        fb = self.frameBody
+        if index is not None:
+            s, fb = s[...,index,:], fb[index]
+        r = poses[...,:3]
+        q = poses[...,3:]
+        R = quatToMatrix(q)
+        P = r[...,fb,:] + np.einsum("...fij,...fj->...fi", R[...,fb,:,:], s)
+        return q, s, P
+
+    def framePositions(self, poses: NDArray, frameLocal: NDArray | None = None, index: NDArray | None = None) -> NDArray:
+        """
+        Global position of every frame, (..., n_frames, 3) in frame table order
+        index selects a subset of the frame table
+        """
+        return self._frameTerms(poses, frameLocal, index)[2]
+
+    def residual(self, poses: NDArray, frameLocal: NDArray | None = None) -> NDArray:
+        """
+        Residual of every joint and quaternion normalization, (..., nResiduals)
+        """
+        q, s, P = self._frameTerms(poses, frameLocal)
+        s = np.broadcast_to(s, P.shape)
+
+        Phi = np.empty(P.shape[:-2] + (self.nResiduals,))
+        for grp in self.groups:
+            g = Gather(p1=P[...,grp.f1,:], p2=P[...,grp.f2,:],
+                       q1=q[...,grp.b1,:], q2=q[...,grp.b2,:],
+                       s1=s[...,grp.f1,:], s2=s[...,grp.f2,:])
+            Phi[...,grp.rows] = grp.jointType.batchResidual(g, grp.params)
+
+        qf = q[...,:self.nFree,:]
+        Phi[...,self.normRows] = np.sum(qf*qf, axis=-1) - 1
+        return Phi
+
+    def jacobianData(self, poses: NDArray, frameLocal: NDArray | None = None) -> NDArray:
+        """
+        Non-zero values of the full jacobian in sparsity pattern order, (..., nnz)
+        """
+        q, s, P = self._frameTerms(poses, frameLocal)
+        s = np.broadcast_to(s, P.shape)
+        J = positionJacobian(q[...,self.frameBody,:], s)
+
+        data = []
+        for grp in self.groups:
+            g = Gather(p1=P[...,grp.f1,:], p2=P[...,grp.f2,:],
+                       q1=q[...,grp.b1,:], q2=q[...,grp.b2,:],
+                       s1=s[...,grp.f1,:], s2=s[...,grp.f2,:],
+                       J1=J[...,grp.f1,:,:], J2=J[...,grp.f2,:,:])
+            block1, block2 = grp.jointType.batchJacobian(g, grp.params)
+            batch = block1.shape[:-3]
+            data.append(block1.reshape(batch + (-1,)))
+            data.append(block2.reshape(batch + (-1,)))
+
+        data.append((2 * q[...,:self.nFree,:]).reshape(q.shape[:-2] + (-1,)))
+        data = np.concatenate(data, axis=-1)
+
+        if self._merge is None:
+            return data[...,self._order]
+        return np.asarray(data @ self._merge)
+
+    def offsetJacobian(self, poses: NDArray, frameLocal: NDArray | None = None) -> NDArray:
+        """
+        Dense derivative of the residual with respect to every frame's local offset,
+        (..., nResiduals, 3 * n_frames) with the columns in frame table order
+        """
+        q, s, P = self._frameTerms(poses, frameLocal)
+        s = np.broadcast_to(s, P.shape)
+        R = quatToMatrix(q)
+        J = positionJacobian(q[...,self.frameBody,:], s)
+
+        D = np.zeros(P.shape[:-2] + (self.nResiduals, len(self.frames), 3))
+        for grp in self.groups:
+            g = Gather(p1=P[...,grp.f1,:], p2=P[...,grp.f2,:],
+                       q1=q[...,grp.b1,:], q2=q[...,grp.b2,:],
+                       s1=s[...,grp.f1,:], s2=s[...,grp.f2,:],
+                       J1=J[...,grp.f1,:,:], J2=J[...,grp.f2,:,:],
+                       R1=R[...,grp.b1,:,:], R2=R[...,grp.b2,:,:])
+            D1, D2 = grp.jointType.batchOffsetJacobian(g, grp.params)
+            D[...,grp.rows,grp.f1[:,None],:] += D1
+            D[...,grp.rows,grp.f2[:,None],:] += D2
+        return D.reshape(P.shape[:-2] + (self.nResiduals, -1))
+
+    def jacobian(self, poses: NDArray, frameLocal: NDArray | None = None, full: bool = False) -> sparse.csr_matrix:
+        """
+        Sparse jacobian for a single set of poses
+        Only the packed state columns unless full=True, in which case the prescribed bodies are included
+        """
+        data = self.jacobianData(poses, frameLocal)
+        if full:
+            return sparse.csr_matrix((data,) + self._csr[:2], shape=self._csr[2])
+        return sparse.csr_matrix((data[self._freeMask],) + self._csrFree[:2], shape=self._csrFree[2])
+
+    def denseJacobian(self, poses: NDArray, frameLocal: NDArray | None = None, full: bool = False) -> NDArray:
+        """
+        Dense jacobian for a stack of poses, (..., nResiduals, nState) or (..., nResiduals, nColumns) if full
+        """
+        data = self.jacobianData(poses, frameLocal)
+        J = np.zeros(data.shape[:-1] + (self.nResiduals * self.nColumns,))
+        J[...,self.linearIndex] = data
+        J = J.reshape(data.shape[:-1] + (self.nResiduals, self.nColumns))
+        return J if full else J[...,:self.nState]
+
+    #%%
+    # Rotation vector formulation
+
+    def tangentBasis(self, poses: NDArray) -> NDArray:
+        """
+        d[r, q]/d[dr, w] of every free body, (..., nFree, 7, 6), identity on r and quatTangent on q
+        """
+        q = poses[...,:self.nFree,3:]
+        E = np.zeros(q.shape[:-1] + (7, 6))
+        E[...,:3,:3] = np.eye(3)
+        E[...,3:,3:] = quatTangent(q)
+        return E
+
+    def tangentJacobian(self, poses: NDArray, frameLocal: NDArray | None = None) -> sparse.csr_matrix:
+        """
+        Sparse jacobian of the joint rows with respect to the tangent coordinates, (nConstraints, nTangent)
+        The pose jacobian times the block diagonal tangentBasis, so it has the pattern of the joint rows
+        """
+        data = self.jacobianData(poses, frameLocal)[self._tangentGather]
+        E = self.tangentBasis(poses)[self._tangentBody]
+        values = np.einsum("ki,kij->kj", data, E).ravel()
+        return sparse.csr_matrix((values,) + self._csrTangent[:2], shape=self._csrTangent[2])
+
+    def denseTangentJacobian(self, poses: NDArray, frameLocal: NDArray | None = None) -> NDArray:
+        """
+        Dense tangentJacobian for a stack of poses, (..., nConstraints, nTangent)
+        """
+        J = self.denseJacobian(poses, frameLocal)[...,:self.nConstraints,:]
+        J = J.reshape(J.shape[:-1] + (self.nFree, 7))
+        return np.einsum("...mbi,...bij->...mbj", J, self.tangentBasis(poses)).reshape(J.shape[:-2] + (-1,))
+
+    def retract(self, poses: NDArray, dx: NDArray) -> NDArray:
+        """
+        Free body poses (..., nFree, 7) moved by tangent steps dx (..., nTangent): r + dr and exp(w) * q
+        The quaternions are renormalized, so round off does not accumulate over many steps
+        """
+        dx = dx.reshape(dx.shape[:-1] + (self.nFree, 6))
+        moved = np.empty(poses.shape[:-2] + (self.nFree, 7))
+        moved[...,:3] = poses[...,:self.nFree,:3] + dx[...,:3]
+        # exp(w) * q = p_w q + [0, p_v] * q, and [0, v] * q = 2 E(q) v
+        q = poses[...,:self.nFree,3:]
+        p = quatFromRotationVector(dx[...,3:])
+        q = p[...,:1] * q + 2 * np.einsum("...ij,...j->...i", quatTangent(q), p[...,1:])
+        moved[...,3:] = q / np.linalg.norm(q, axis=-1, keepdims=True)
+        return moved
 
 
 #%%
@@ -126,45 +896,185 @@ class MultibodySystem:
     residual: This is a function to build the residuals of the multibody system.
     The joints each have their own residual method that will be used to add those residuals to the build
     The quaternion residual of constraining the quaternion vector to have a magnitude of one is then added (quaternion normalization)
+
+    jacobian: The analytic derivative of residual with respect to the packed state, as a sparse matrix.
+
+    Both are evaluated through the compiled form of the system (see CompiledSystem), which is built
+    on first use and rebuilt whenever bodies or joints are added.
+
+    state: The system owns a single pose buffer, and the free bodies' r and q are views into it.
+    unpack is one copy into the buffer and pack is one copy out of it.
     """
     def __init__(self) -> None:
         self.bodies = []
         self.joints = []
+        self.compiled = None
+        self.solver = None
 
     def addBody(self, body: list) -> None:
         self.bodies.extend(body)
+        self.compiled = None
 
     def addJoint(self, joint: list) -> None:
         self.joints.extend(joint)
+        self.compiled = None
 
-    def pack(self):
-        x=[]
+    def compile(self) -> CompiledSystem:
+        self.compiled = CompiledSystem(self)
+        return self.compiled
+
+    def getBody(self, name: str) -> Body:
         for body in self.bodies:
-            if body.free == False:
-                continue
-            x.extend(body.r)
-            x.extend(body.q)
-        return np.array(x)
-    
-    def unpack(self,x):
+            if body.name == name:
+                return body
+        raise KeyError(f"No body named {name}")
+
+    def getFrame(self, name: str, body: str | None = None) -> Frame:
+        """
+        Frame by name, on the named body if given (frames that share a hardpoint share its name)
+        """
+        bodies = self.bodies if body is None else [self.getBody(body)]
+        for b in bodies:
+            for f in b.frames:
+                if f.name == name:
+                    return f
+        raise KeyError(f"No frame named {name}" + ("" if body is None else f" on {body}"))
+
+    def stateIndex(self) -> dict:
+        """
+        Column offset of each free body in the packed state vector, keyed by body
+        """
+        index = {}
         idx = 0
         for body in self.bodies:
             if body.free == False:
                 continue
-            body.r = x[idx:idx+3]
-            idx +=3
-            body.q = x[idx:idx+4]
-            idx += 4
+            index[body] = idx
+            idx += 7
+        return index
+
+    @property
+    def state(self) -> NDArray:
+        """
+        The packed state vector, a view into the system's pose buffer
+        Writing into it moves the free bodies
+        """
+        return self._compiled().state
+
+    def pack(self) -> NDArray:
+        """
+        Snapshot of the packed state vector (a single copy of the state buffer)
+        """
+        return self.state.copy()
+    
+    def unpack(self, x: NDArray) -> None:
+        state = self.state
+        if x is not state:
+            state[:] = x
+
+    def poses(self) -> NDArray:
+        """
+        Pose table [r, q] of every body, in compiled (free first) order
+        This is the system's pose buffer itself, not a copy
+        """
+        return self._compiled().buffer
+
+    def _compiled(self) -> CompiledSystem:
+        if self.compiled is None:
+            self.compile()
+        return self.compiled
 
     def residual(self) -> NDArray:
+        poses = self.poses()
+        return self.compiled.residual(poses)
 
-        Phi = [] # residual variable
+    def historyPoses(self, history, drive: dict | None = None) -> NDArray:
+        """
+        Stack of pose tables (steps, n_bodies, 7) from a history
+        history is a Trajectory, a (steps, n_bodies, 7) pose stack, or a (steps, nState) stack of states.
+        A state stack does not hold the driven bodies, so their poses at every step have to be given as
+        drive ({body: (steps, 7)}, e.g. DOE.drive). Every function taking a history passes its drive on here.
+        Bodies without a motion keep their current pose
+        """
+        compiled = self._compiled()
+        if hasattr(history, "poses") and not callable(history.poses):
+            return history.poses
 
-        # Joint residuals
-        for joint in self.joints:
-            Phi.append(joint.residual())
+        history = np.asarray(history, dtype=float)
+        if history.ndim == 3:
+            return history
 
-        for body in self.bodies:
-            Phi.append(body.residual())
+        drive = drive or {}
+        missing = [b.name for b in compiled.bodies[compiled.nFree:] if b.motion is not None and b not in drive]
+        if missing:
+            raise ValueError(
+                f"A state history does not hold the driven bodies {missing}, pass a Trajectory or pose stack "
+                "instead, or their poses as drive."
+            )
+
+        poses = np.repeat(compiled.buffer[None], len(history), axis=0)
+        poses[:,:compiled.nFree] = history.reshape(len(history), compiled.nFree, 7)
+        for body, p in drive.items():
+            poses[:,compiled.bodyIndex[body]] = p
+        return poses
+
+    def framePositions(self, history, frames: list | None = None, drive: dict | None = None) -> NDArray:
+        """
+        Global positions of frames at every step of a history, (steps, n_frames, 3)
+        Uses one batched quaternion to matrix conversion and one einsum for the whole history.
+
+        :param history: See historyPoses
+        :param frames: Frames to extract, defaults to every frame in compiled order (compiled.frames)
+        :param drive: Driven body poses of a state history, see historyPoses
+        """
+        compiled = self._compiled()
+        poses = self.historyPoses(history, drive)
+        index = None if frames is None else np.array([compiled.frameIndex[f] for f in frames], dtype=int)
+        return compiled.framePositions(poses, index=index)
+
+    def transformPoints(self, history, body: Body, name: str, steps=None, chunkSize: int | None = None,
+                        dtype=np.float64, drive: dict | None = None):
+        """
+        Generator over the global positions of a body's attached point set across a history
+        Yields (steps, points): the step indices of the chunk and their (n_steps, n_points, 3) positions,
+        each chunk is a single batched matmul, so the whole cloud over the whole history never sits in memory
+
+        :param history: See historyPoses, e.g. a memory mapped Trajectory
+        :param steps: Step indices or slice to transform, defaults to every step
+        :param chunkSize: Steps per chunk, defaults to about 2**22 output values per chunk
+        :param dtype: np.float32 halves the memory and bandwidth of the output
+        :param drive: Driven body poses of a state history, see historyPoses
+        """
+        compiled = self._compiled()
+        poses = self.historyPoses(history, drive)
+        i = compiled.bodyIndex[body]
+        local = body.points[name].astype(dtype, copy=False)
+
+        steps = np.arange(len(poses))[slice(None) if steps is None else steps]
+        chunkSize = chunkSize or max(1, 2**22 // (3 * len(local)))
+        for start in range(0, len(steps), chunkSize):
+            chunk = steps[start:start + chunkSize]
+            pose = np.asarray(poses[chunk, i], dtype=float)
+            R = quatToMatrix(pose[:,3:]).astype(dtype, copy=False)
+            r = pose[:,None,:3].astype(dtype, copy=False)
+            yield chunk, np.matmul(local, R.transpose(0, 2, 1)) + r
+
+    def solve(self, x0: NDArray | None = None, solver=None) -> NDArray:
+        """
+        Assembles the system, starting from x0 or the current state
+        Uses the given solver, or a default NewtonSolver that is kept (with its factorization) between calls
+        """
+        if solver is None:
+            if self.solver is None:
+                from solver import NewtonSolver
+                self.solver = NewtonSolver(self)
+            solver = self.solver
+        return solver.solve(x0)
 
-        return np.concatenate(Phi)
\ No newline at end of file
+    def jacobian(self, full: bool = False) -> sparse.csr_matrix:
+        """
+        Sparse jacobian of residual() with respect to the packed state vector
+        With full=True the columns of the prescribed bodies are appended after the state
+        """
+        poses = self.poses()
+        return self.compiled.jacobian(poses, full=full)
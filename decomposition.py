@@ -0,0 +1,263 @@
+import numpy as np
+from numpy.typing import NDArray
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components, maximum_bipartite_matching
+from components import MultibodySystem, CompiledSystem
+from solver import NewtonSolver, _gaussNewton
+
+
+#%%
+# Constraint graph analysis
+
+class ConstraintBlock:
+    """
+    One diagonal block of the block triangular ordering: free bodies solved together and the joints
+    whose residuals decide them. Every other body a joint touches is either prescribed or belongs to a
+    block in depends, which is solved first.
+    """
+
+    def __init__(self, bodies: list, joints: list, depends: set, level: int) -> None:
+        self.bodies = bodies
+        self.joints = joints
+        self.depends = depends
+        self.level = level
+
+    def __repr__(self) -> str:
+        return f"ConstraintBlock({[b.name for b in self.bodies]}, {len(self.joints)} joints, level {self.level})"
+
+
+def constraintBlocks(sys: MultibodySystem) -> tuple:
+    """
+    Block triangular decomposition of the constraint equations.
+
+    The equation - variable incidence is the sparsity pattern of the jacobian. A maximum matching assigns
+    residual rows to state columns, and a free body depends on every body its matched rows touch.
+    The strongly connected components of that dependency graph (at the body level, so a body is never
+    split) are the blocks, in topological order with the dependencies first.
+    With redundant constraints the matching is not unique and may tie a body into a cycle it does not need,
+    so a body is peeled off into its own later block when the rest of its block is still determined
+    without the rows that touch it. Structure alone overestimates that (two spherical joints look like
+    they hold an arm, but leave it free to spin about their axis), so it is checked by the rank of
+    the jacobian at the current configuration.
+
+    Each joint is assigned to the last block among its free bodies, so a block's equations only involve
+    its own bodies and those of earlier blocks. Joints between prescribed bodies only are constant and left out.
+    level is the length of the longest dependency chain below a block, blocks of one level are independent.
+
+    :return: (blocks, components), the ConstraintBlocks in solve order and the lists of block indices that
+             form the connected components of the constraint graph, which share no free body or joint
+    """
+    compiled = sys._compiled()
+    nFree = compiled.nFree
+    J = compiled.jacobian(compiled.buffer).tocsr()
+    columnBody = np.arange(compiled.nState) // 7
+    rowBodies = [set(columnBody[J.indices[J.indptr[r]:J.indptr[r + 1]]]) for r in range(compiled.nResiduals)]
+
+    # Body dependencies from the matched rows, B -> C when a row matched to a column of B touches C
+    match = maximum_bipartite_matching(J, perm_type="column")
+    src, dst = [], []
+    for r, c in enumerate(match):
+        for k in rowBodies[r] if c >= 0 else ():
+            if k != columnBody[c]:
+                src.append(columnBody[c])
+                dst.append(k)
+    graph = sparse.csr_matrix((np.ones(len(src)), (src, dst)), shape=(nFree, nFree))
+    nBlocks, label = connected_components(graph, directed=True, connection="strong")
+
+    depends = [set() for _ in range(nBlocks)]
+    for b, c in zip(src, dst):
+        if label[b] != label[c]:
+            depends[label[b]].add(label[c])
+    order = []
+    def visit(i):
+        if i not in order:
+            for j in sorted(depends[i]):
+                visit(j)
+            order.append(i)
+    for i in range(nBlocks):
+        visit(i)
+
+    # Peel off bodies the rest of their block does not need
+    blocks = [set(np.flatnonzero(label == i)) for i in order]
+    k = 0
+    while k < len(blocks):
+        done = set().union(*blocks[:k])
+        for h in sorted(blocks[k]) if len(blocks[k]) > 1 else ():
+            rest = blocks[k] - {h}
+            if (_determined(J, rowBodies, rest, done) and _determined(J, rowBodies, {h}, done | rest)):
+                blocks[k:k + 1] = [rest, {h}]
+                break
+        else:
+            k += 1
+
+    # Joints go to the last block among their free bodies, which sets the dependencies
+    blockOf = {b: i for i, block in enumerate(blocks) for b in block}
+    result = [ConstraintBlock([compiled.bodies[b] for b in sorted(block)], [], set(), 0) for block in blocks]
+    for joint in sys.joints:
+        owners = [blockOf[compiled.bodyIndex[b]] for b in (joint.frame1.body, joint.frame2.body)
+                  if compiled.bodyIndex[b] < nFree]
+        if owners:
+            result[max(owners)].joints.append(joint)
+            result[max(owners)].depends.update(i for i in owners if i != max(owners))
+    for block in result:
+        block.level = 1 + max((result[i].level for i in block.depends), default=-1)
+
+    # Connected components, the blocks linked by a dependency in either direction
+    a = [i for i, b in enumerate(result) for j in b.depends]
+    b = [j for block in result for j in block.depends]
+    nComponents, component = connected_components(
+        sparse.csr_matrix((np.ones(2 * len(a)), (a + b, b + a)), shape=(len(result), len(result))), directed=False
+    )
+    components = [[int(i) for i in np.flatnonzero(component == k)] for k in range(nComponents)]
+    return result, components
+
+
+def _determined(J: sparse.csr_matrix, rowBodies: list, bodies: set, done: set) -> bool:
+    """
+    Whether the rows that only touch bodies and done determine every column of bodies (full column rank)
+    """
+    rows = [r for r, touched in enumerate(rowBodies) if touched & bodies and touched <= bodies | done]
+    columns = [7*b + i for b in sorted(bodies) for i in range(7)]
+    if len(rows) < len(columns):
+        return False
+    return np.linalg.matrix_rank(J[rows][:, columns].toarray()) == len(columns)
+
+
+#%%
+# Decomposed Solver Class
+
+class _Subsystem:
+    """
+    The bodies and joints of one block, in the shape CompiledSystem expects
+    """
+
+    def __init__(self, bodies: list, joints: list) -> None:
+        self.bodies = bodies
+        self.joints = joints
+
+
+class DecomposedSolver:
+    """
+    Solves the constraints block by block (see constraintBlocks) instead of as one problem.
+
+    Every block has its own compiled form over its free bodies and the bodies its joints touch, which
+    are held at their current poses, so an iteration costs as much as the block and not the whole system.
+    Blocks are solved level by level. Blocks of one level with the same structure (e.g. the corners of
+    a vehicle) are stacked into one batched Gauss-Newton solve, each with its own frame table.
+    With an executor (a concurrent.futures ThreadPoolExecutor or ProcessPoolExecutor) the blocks of
+    a level are solved concurrently instead, one task per block (numpy releases the GIL in the batched
+    linear algebra, so threads run in parallel). A process pool pickles the block's compiled form with every solve.
+
+    coordinates="rotationVector" solves every block in the rotation vector formulation (see NewtonSolver).
+
+    Drop in for NewtonSolver.solve, e.g. kinematicsSim(sys, n, solver=DecomposedSolver(sys)).
+    stats counts the solves and the block solves, and holds the number of states of the largest block.
+    """
+
+    def __init__(self, sys: MultibodySystem, tol: float = 1e-10, maxIter: int = 20, executor=None,
+                 coordinates: str = "quaternion") -> None:
+        if coordinates not in NewtonSolver.COORDINATES:
+            raise ValueError(f"Unknown coordinates {coordinates}, expected one of {NewtonSolver.COORDINATES}")
+        self.sys = sys
+        self.tol = tol
+        self.maxIter = maxIter
+        self.executor = executor
+        self.tangent = coordinates == "rotationVector"
+        self.blocks, self.components = constraintBlocks(sys)
+
+        compiled = sys._compiled()
+        self._compiled = compiled
+        problems = []
+        for block in self.blocks:
+            touched = [f.body for j in block.joints for f in (j.frame1, j.frame2)]
+            bodies = block.bodies + [b for b in dict.fromkeys(touched) if b not in block.bodies]
+            sub = CompiledSystem(_Subsystem(bodies, block.joints), bind=False, free=block.bodies)
+            bodyMap = np.array([compiled.bodyIndex[b] for b in sub.bodies])
+            frameMap = np.array([compiled.frameIndex[f] for f in sub.frames])
+            problems.append((sub, bodyMap, frameMap))
+
+        # Stacks of same structure blocks per level, (sub, bodyMaps (n, n_bodies), frameMaps (n, n_frames))
+        self.levels = []
+        for k in range(1 + max((b.level for b in self.blocks), default=-1)):
+            stacks = {}
+            for i, block in enumerate(self.blocks):
+                if block.level == k:
+                    sub = problems[i][0]
+                    stacks.setdefault(_structure(sub), []).append(problems[i])
+            self.levels.append([(p[0][0], np.stack([m for _, m, _ in p]), np.stack([m for _, _, m in p]))
+                                for p in stacks.values()])
+
+        self.stats = {"solves": 0, "blockSolves": 0,
+                      "largest": max((7 * len(b.bodies) for b in self.blocks), default=0)}
+
+    def solve(self, x0: NDArray | None = None) -> NDArray:
+        """
+        Solves the constraints starting from x0 (default: the current state)
+        The solution is left in the system state, a copy is returned
+        """
+        sys = self.sys
+        if x0 is not None:
+            sys.unpack(x0)
+        self.stats["solves"] += 1
+        buffer = self._compiled.buffer
+        buffer[...] = self.solveBatch(buffer[None])[0]
+        return sys.pack()
+
+    def solveBatch(self, poses: NDArray, chunkSize: int = 4096) -> NDArray:
+        """
+        Solves a stack of configurations at once, every block of every configuration stacked with the
+        others of its structure, e.g. a chassis pose grid of a vehicle
+
+        :param poses: (N, n_bodies, 7) pose tables in compiled order, with the driven bodies at their
+                      inputs and the free bodies at the initial guess
+        :param chunkSize: Configurations solved together
+        :return: (N, n_bodies, 7) solved pose tables
+        """
+        if self._compiled is not self.sys._compiled():
+            raise RuntimeError("The system was recompiled, build a new DecomposedSolver.")
+        frameLocal = self._compiled.frameLocal
+        poses = np.array(poses, dtype=float)
+
+        for start in range(0, len(poses), chunkSize):
+            P = poses[start:start + chunkSize]
+            N = len(P)
+            for level in self.levels:
+                # One task per stack, or with an executor one per block so the blocks run concurrently
+                tasks = []
+                for sub, bodyMaps, frameMaps in level:
+                    split = np.arange(len(bodyMaps))[:,None] if self.executor is not None else [slice(None)]
+                    for part in split:
+                        n = len(bodyMaps[part])
+                        S = np.broadcast_to(frameLocal[frameMaps[part]], (N, n) + frameMaps.shape[1:] + (3,))
+                        tasks.append((sub, bodyMaps[part], (sub, P[:,bodyMaps[part]].reshape(N * n, -1, 7),
+                                      S.reshape(N * n, -1, 3), self.tol, self.maxIter, self.tangent)))
+                if self.executor is None or len(tasks) == 1:
+                    results = [_solveBlocks(*a) for _, _, a in tasks]
+                else:
+                    results = [f.result() for f in [self.executor.submit(_solveBlocks, *a) for _, _, a in tasks]]
+
+                for (sub, bodyMaps, _), X in zip(tasks, results):
+                    P[:,bodyMaps[:,:sub.nFree]] = X.reshape(N, len(bodyMaps), sub.nFree, 7)
+                    self.stats["blockSolves"] += len(X)
+
+        return poses
+
+
+def _structure(sub: CompiledSystem) -> tuple:
+    """
+    Blocks with equal structure and joint parameters can share one compiled form
+    """
+    return (sub.nFree, sub.frameBody.tobytes(),
+            tuple((g.jointType, g.rows.tobytes(), g.f1.tobytes(), g.f2.tobytes(), g.params.tobytes())
+                  for g in sub.groups))
+
+
+def _solveBlocks(sub: CompiledSystem, poses: NDArray, frameLocal: NDArray, tol: float, maxIter: int,
+                 tangent: bool = False) -> NDArray:
+    """
+    Batched Gauss-Newton on a stack of same structure blocks, from their bodies' current poses
+    Module level so a process pool can run it
+    """
+    X, _ = _gaussNewton(sub, poses.copy(), poses[:,:sub.nFree].reshape(len(poses), -1), tol, maxIter, frameLocal,
+                        tangent)
+    return X
@@ -0,0 +1,289 @@
+import numpy as np
+from numpy.typing import NDArray
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from components import MultibodySystem
+from suspension_util import AXES, readParams, buildDoubleWishbone
+from solver import motionPoses, solveBatch
+from kinematicsSim import heave_motion
+from checkpoint import Checkpoint
+from solveCache import digest
+
+
+#%%
+# Designs
+# Every design returns coded levels in [-1, 1], one row per variant and one column per factor
+
+def gridDesign(nFactors: int, levels: int = 3) -> NDArray:
+    """
+    Full factorial grid with the given number of levels per factor
+    """
+    axis = np.linspace(-1, 1, levels)
+    mesh = np.meshgrid(*[axis] * nFactors, indexing="ij")
+    return np.stack([m.ravel() for m in mesh], axis=-1)
+
+def latinHypercube(nFactors: int, samples: int = 10, seed: int | None = None) -> NDArray:
+    """
+    Latin hypercube sample, every factor hits each of the samples strata exactly once
+    """
+    rng = np.random.default_rng(seed)
+    strata = np.argsort(rng.random((nFactors, samples)), axis=1).T
+    u = (strata + rng.random((samples, nFactors))) / samples
+    return 2 * u - 1
+
+def oneAtATime(nFactors: int) -> NDArray:
+    """
+    The baseline followed by every factor at its low and high level with the others at baseline
+    """
+    coded = np.zeros((1 + 2 * nFactors, nFactors))
+    for i in range(nFactors):
+        coded[1 + 2*i, i] = -1
+        coded[2 + 2*i, i] = 1
+    return coded
+
+DESIGNS = {
+    "grid": gridDesign,
+    "lhs": latinHypercube,
+    "oat": oneAtATime,
+}
+
+
+#%%
+# DOE Class
+
+class DOE:
+    """
+    Hardpoint design of experiments.
+    Perturbs the hardpoints of a base parameter file and runs the heave sweep for every variant.
+
+    :param file: Base parameter file, e.g. doubleWishboneParams.csv
+    :param factors: {(hardpoint, axis): delta}, e.g. {("upriUppPnt", "z"): 0.25}
+                    A coded level of +-1 moves the hardpoint coordinate by +-delta
+    :param design: "grid", "lhs" or "oat"
+    :param steps: Steps of the heave sweep, passed to the motion like kinematicsSim does
+    :param designOptions: Passed to the design function (levels, samples, seed)
+    """
+
+    def __init__(self, file: str, factors: dict, design: str = "oat", steps=range(20),
+                 motion=heave_motion, **designOptions) -> None:
+        self.hardpoints, self.params = readParams(file)
+        self.factors = list(factors.items())
+        self.coded = DESIGNS[design](len(self.factors), **designOptions)
+        self.steps = list(steps)
+        self.motion = motion
+
+        for (name, axis), _ in self.factors:
+            if name not in self.hardpoints:
+                raise KeyError(f"Unknown hardpoint {name}")
+
+    def variant(self, i: int) -> dict:
+        """
+        Hardpoints of variant i
+        """
+        hardpoints = {name: p.copy() for name, p in self.hardpoints.items()}
+        for level, ((name, axis), delta) in zip(self.coded[i], self.factors):
+            hardpoints[name][AXES[axis]] += level * delta
+        return hardpoints
+
+    def drive(self, sys: MultibodySystem) -> dict:
+        """
+        Poses of the driven chassis at every row of a variant's trajectory, for MultibodySystem.historyPoses
+        sys is the variant as its worker builds it, e.g.
+        metrics.compute(trajectories[i], drive=doe.drive(buildDoubleWishbone(hardpoints=doe.variant(i), params=doe.params)))
+        """
+        chassis = next(b for b in sys.bodies if b.motion is not None)
+        start = np.concatenate([chassis.r, chassis.q])
+        return {chassis: np.vstack([start, motionPoses(self.motion, self.steps)])}
+
+    def __len__(self) -> int:
+        return len(self.coded)
+
+    def key(self) -> str:
+        """
+        Hash of everything that decides the trajectories: base hardpoints, params, factors, design and drive
+        """
+        return digest(sorted((n, tuple(p)) for n, p in self.hardpoints.items()), sorted(self.params.items()),
+                      self.factors, self.coded, motionPoses(self.motion, self.steps))
+
+    def start(self, maxWorkers: int | None = None, chunkSize: int | None = None, callback=None,
+              checkpoint: str | None = None) -> "DOEJob":
+        """
+        Starts the sweeps on a process pool and returns immediately
+        callback(done, total) is called every time a chunk of variants finishes
+        With a checkpoint directory every finished chunk is appended to it, and a job started on the
+        checkpoint of the same DOE only runs the variants that are not in it yet (another DOE's raises)
+        """
+        return DOEJob(self, maxWorkers, chunkSize, callback, checkpoint)
+
+    def run(self, maxWorkers: int | None = None, chunkSize: int | None = None, callback=None,
+            checkpoint: str | None = None) -> tuple:
+        return self.start(maxWorkers, chunkSize, callback, checkpoint).result()
+
+
+#%%
+# DOE Job Class
+
+class DOEJob:
+    """
+    A running DOE.
+    The trajectories of all variants are written by the workers straight into one shared memory
+    array of shape (n_variants, n_steps+1, n_state), nothing but the status flags is pickled back.
+    Chunks of variants are submitted as workers free up, so at most two chunks per worker are queued.
+
+    status: 0 not run, 1 solved, -1 failed (its trajectory is nan)
+    The trajectories are states, so their driven chassis poses come from DOE.drive
+
+    With a checkpoint directory, the variants, status and trajectories of every finished chunk are appended
+    to its "index", "status" and "trajectories" stores. Chunks whose worker raised are not committed,
+    so they run again on resume.
+    """
+
+    def __init__(self, doe: DOE, maxWorkers: int | None, chunkSize: int | None, callback,
+                 checkpoint: str | None = None) -> None:
+        self.doe = doe
+        self.callback = callback
+        self.maxWorkers = maxWorkers or os.cpu_count()
+        n = len(doe)
+
+        nState = buildDoubleWishbone(hardpoints=doe.hardpoints, params=doe.params).state.size
+        self.shape = (n, len(doe.steps) + 1, nState)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(self.shape)) * 8)
+        self.trajectories = np.ndarray(self.shape, dtype=float, buffer=self._shm.buf)
+        self.status = np.zeros(n, dtype=int)
+
+        self._checkpoint = None if checkpoint is None else Checkpoint(checkpoint)
+        if self._checkpoint is not None:
+            self._key = doe.key()
+            self._resume()
+
+        todo = np.flatnonzero(self.status == 0)
+        chunkSize = chunkSize or max(1, len(todo) // (4 * self.maxWorkers))
+        self._chunks = [todo[i:i + chunkSize] for i in range(0, len(todo), chunkSize)]
+
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._cancelled = False
+        self._next = 0
+        self._running = 0
+        self._done = n - len(todo)
+
+        self._executor = ProcessPoolExecutor(self.maxWorkers)
+        with self._lock:
+            for _ in range(min(2 * self.maxWorkers, len(self._chunks))):
+                self._submitNext()
+            if self._running == 0:
+                self._finished.set()
+
+    def _submitNext(self) -> None:
+        # Called with the lock held
+        chunk = self._chunks[self._next]
+        self._next += 1
+        self._running += 1
+        variants = [self.doe.variant(i) for i in chunk]
+        future = self._executor.submit(
+            _solveVariants, self._shm.name, self.shape, list(chunk), variants,
+            self.doe.params, self.doe.motion, self.doe.steps
+        )
+        future.add_done_callback(lambda f, chunk=chunk: self._chunkDone(f, chunk))
+
+    def _resume(self) -> None:
+        """
+        Loads the variants already in the checkpoint, which has to be one of the same DOE
+        """
+        checkpoint = self._checkpoint
+        state = checkpoint.state()
+        if state is None:
+            return
+        if str(state["key"]) != self._key:
+            self._shm.close()
+            self._shm.unlink()
+            raise RuntimeError(f"{checkpoint.directory} holds the checkpoint of another DOE.")
+        checkpoint.recover()
+        index = checkpoint.read("index", mmap=False)
+        self.status[index] = checkpoint.read("status", mmap=False)
+        self.trajectories[index] = checkpoint.read("trajectories").reshape((len(index),) + self.shape[1:])
+
+    def _chunkDone(self, future, chunk: NDArray) -> None:
+        with self._lock:
+            self._running -= 1
+            if not future.cancelled():
+                if future.exception() is None:
+                    self.status[chunk] = future.result()
+                    if self._checkpoint is not None:
+                        self._checkpoint.commit(
+                            {"index": chunk, "status": self.status[chunk],
+                             "trajectories": self.trajectories[chunk].reshape(len(chunk), -1)},
+                            key=self._key,
+                        )
+                else:
+                    self.status[chunk] = -1
+                self._done += len(chunk)
+            if not self._cancelled and self._next < len(self._chunks):
+                self._submitNext()
+            if self._running == 0:
+                self._finished.set()
+
+        if self.callback is not None:
+            self.callback(*self.progress())
+
+    def progress(self) -> tuple:
+        """
+        (variants done, total variants)
+        """
+        return self._done, len(self.doe)
+
+    def cancel(self) -> None:
+        """
+        Stops submitting chunks, queued chunks are dropped and running ones are allowed to finish
+        """
+        with self._lock:
+            self._cancelled = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def done(self) -> bool:
+        return self._finished.is_set()
+
+    def result(self, timeout: float | None = None) -> tuple:
+        """
+        Waits for the job and releases the pool and shared memory
+        :return: (trajectories, status)
+        """
+        if not self._finished.wait(timeout):
+            raise TimeoutError("DOE did not finish in time.")
+        self._executor.shutdown()
+
+        if self._shm is not None:
+            self.trajectories = self.trajectories.copy()
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+        return self.trajectories, self.status
+
+
+def _solveVariants(shmName: str, shape: tuple, indices: list, variants: list, params: dict, motion, steps: list) -> NDArray:
+    """
+    Worker: solves a chunk of variants and writes their trajectories into the shared result array
+    """
+    shm = shared_memory.SharedMemory(name=shmName)
+    out = np.ndarray(shape, dtype=float, buffer=shm.buf)
+
+    status = np.empty(len(indices), dtype=int)
+    for k, (i, hardpoints) in enumerate(zip(indices, variants)):
+        sys = buildDoubleWishbone(hardpoints=hardpoints, params=params)
+        chassis = next(b for b in sys.bodies if b.motion is not None)
+        x0 = sys.pack()
+        try:
+            out[i, 0] = x0
+            out[i, 1:] = solveBatch(sys, {chassis: motionPoses(motion, steps)}, x0)
+            status[k] = 1
+        except (RuntimeError, np.linalg.LinAlgError):
+            out[i] = np.nan
+            status[k] = -1
+
+    del out
+    shm.close()
+    return status
@@ -0,0 +1,108 @@
+import numpy as np
+from numpy.typing import NDArray
+from components import MultibodySystem, Body, Tire
+
+
+# Voxel indices are packed into one int64 key, 21 bits per axis
+_BITS = 21
+_BIAS = 1 << (_BITS - 1)
+_MASK = (1 << _BITS) - 1
+
+
+#%%
+# Swept Volume Class
+
+class SweptVolume:
+    """
+    Sparse occupancy grid of the space a body's points pass through over a sweep, e.g. the tire
+    over heave and steer for packaging.
+
+    Points are binned into cubic voxels of the given resolution (cell i covers origin + [i, i+1) * resolution).
+    Occupied cells are kept as a sorted array of packed integer keys, so memory grows with the occupied
+    cells only, and new points are merged in batches as the sweep streams by.
+
+    The grid records the cells the points land in, so the point spacing and the motion between steps
+    should both be below the resolution for a closed envelope (sweep picks the tire cloud resolution for that).
+    """
+
+    def __init__(self, resolution: float, origin: NDArray | list = [0,0,0]) -> None:
+        self.resolution = float(resolution)
+        self.origin = np.asarray(origin, dtype=float)
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._pending = []
+        self._nPending = 0
+
+    def add(self, points: NDArray) -> None:
+        """
+        Marks the cells of a batch of points, (..., 3)
+        """
+        ijk = np.floor((np.reshape(points, (-1, 3)) - self.origin) / self.resolution).astype(np.int64)
+        if ijk.size and (ijk.min() < -_BIAS or ijk.max() >= _BIAS):
+            raise ValueError("Points fall outside the range of the voxel grid, use a coarser resolution or move the origin.")
+        keys = np.unique(((ijk[:,0] + _BIAS) << 2*_BITS) | ((ijk[:,1] + _BIAS) << _BITS) | (ijk[:,2] + _BIAS))
+
+        self._pending.append(keys)
+        self._nPending += len(keys)
+        if self._nPending > max(len(self._keys), 1 << 20):
+            self._merge()
+
+    def _merge(self) -> None:
+        if self._pending:
+            self._keys = np.unique(np.concatenate([self._keys] + self._pending))
+            self._pending = []
+            self._nPending = 0
+
+    def sweep(self, sys: MultibodySystem, history, body: Body, name: str | None = None, steps=None,
+              chunkSize: int | None = None, drive: dict | None = None) -> "SweptVolume":
+        """
+        Accumulates a body's attached point set over a history, chunk by chunk (see MultibodySystem.transformPoints)
+        Without a name the body must be a Tire, and its point cloud is attached at a spacing finer than the resolution
+        """
+        if name is None:
+            if not isinstance(body, Tire):
+                raise TypeError("A point set name is needed unless the body is a Tire.")
+            n = int(np.ceil(np.pi * body.OD / self.resolution)) + 1
+            name = f"envelope{n}"
+            if name not in body.points:
+                body.attachPoints(name, body.pointCloud(n))
+
+        for _, points in sys.transformPoints(history, body, name, steps, chunkSize, drive=drive):
+            self.add(points)
+        return self
+
+    #%%
+    # Export
+
+    def indices(self) -> NDArray:
+        """
+        (n, 3) integer indices of the occupied cells
+        """
+        self._merge()
+        k = self._keys
+        return np.stack([(k >> 2*_BITS) & _MASK, (k >> _BITS) & _MASK, k & _MASK], axis=-1) - _BIAS
+
+    def centers(self) -> NDArray:
+        """
+        (n, 3) centers of the occupied cells
+        """
+        return self.origin + (self.indices() + 0.5) * self.resolution
+
+    def toArray(self) -> tuple:
+        """
+        Dense boolean occupancy over the bounding box of the occupied cells
+        :return: (grid, origin), cell [i,j,k] of grid covers origin + [i, i+1) * resolution, ...
+        """
+        ijk = self.indices()
+        if len(ijk) == 0:
+            return np.zeros((0, 0, 0), dtype=bool), self.origin.copy()
+        lower = ijk.min(axis=0)
+        grid = np.zeros(ijk.max(axis=0) - lower + 1, dtype=bool)
+        grid[tuple((ijk - lower).T)] = True
+        return grid, self.origin + lower * self.resolution
+
+    def volume(self) -> float:
+        return len(self) * self.resolution**3
+
+    def __len__(self) -> int:
+        self._merge()
+        return len(self._keys)
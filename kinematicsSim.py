@@ -1,8 +1,9 @@
 from components import MultibodySystem, Body, Frame, SphericalJoint, CartesianJoint
 import numpy as np
-from scipy.optimize import least_squares
+from solver import NewtonSolver, drivePoses, applyDrive, solveBatch
+from trajectory import Trajectory
 
-SOLVER = least_squares
+SOLVER = "newton" # or "least_squares"
 
 def heave_motion(step):
         dz = step * 0.1
@@ -24,13 +25,13 @@ def buildSuspension():
 
     # Define the bodies
     world = Body(
-        name="world", fixed=True
+        "world", [0,0,0], [1,0,0,0], free=False
     )
     world.addFrame([Frame([0,0,0]),
                     world_UCA_outboard])
 
     chassis = Body(
-        name="chassis", fixed=True
+        "chassis", [0,0,0], [1,0,0,0], free=False
         )
     chassis.addFrame([chassis_UCA_fore,
                     chassis_UCA_aft])
@@ -38,20 +39,18 @@ def buildSuspension():
 
 
     UCA = Body(
-        name="UCA", fixed=False
+        "UCA", [0,0,0], [1,0,0,0], free=True
             )
     UCA.addFrame([UCA_fore,
                 UCA_aft,
                 UCA_outboard])
     
 
-    sj_UCA_fore = SphericalJoint(chassis, chassis_UCA_fore,
-                            UCA, UCA_fore)
+    sj_UCA_fore = SphericalJoint(chassis_UCA_fore, UCA_fore)
 
-    sj_UCA_aft = SphericalJoint(chassis, chassis_UCA_aft,
-                                UCA, UCA_aft)
+    sj_UCA_aft = SphericalJoint(chassis_UCA_aft, UCA_aft)
     
-    cart_UCA_outboard = CartesianJoint(UCA, UCA_outboard, world, world_UCA_outboard)
+    cart_UCA_outboard = CartesianJoint(UCA_outboard, world_UCA_outboard, fixedAxis=[0,0,1])
 
     sys = MultibodySystem()
     sys.addBody([world,chassis,UCA])
@@ -59,31 +58,53 @@ def buildSuspension():
 
     return(sys)
 
-def apply_motion(sys,step):
-    for body in sys.bodies:
-        if body.motion_func is not None:
-            r_new, q_new = heave_motion(step)
-            body.r = r_new
-            body.q = q_new
-
-def kinematicsSim(sys, n_steps):
+def kinematicsSim(sys, n_steps, solver=None, path=None, guess=None):
+    """
+    Solves the system at every step of the motion
+    Returns a Trajectory of the poses (initial state first), stored in memory or in the .npy file at path
+    guess optionally holds an initial guess for every step, (n_steps+1, nState), e.g. a nearby design's states
+    """
 
     x0 = sys.pack()
-    hist = [x0]
+    hist = Trajectory(sys, capacity=n_steps + 1, path=path)
+    hist.record()
+
+    # The jacobian factorization is reused between steps while it keeps converging
+    solver = solver or NewtonSolver(sys, reuse=True, backend=SOLVER)
 
-    def residual_fun(x):
-        sys.unpack(x)
-        return(sys.residual())
+    # The driven bodies' poses over the whole sweep, each step only indexes into them
+    drive = drivePoses(sys, range(n_steps))
 
-    # now we are going to loop through the motion of the specified body (chassis)
+    # now we are going to loop through the motion of the driven bodies
     for step in range(n_steps):
         
-        apply_motion(sys, step)
+        applyDrive(sys, drive, step)
+
+        x0 = solver.solve(x0 if guess is None else guess[step + 1])
+
+        hist.record()
+
+    hist.flush()
+    return (hist)
 
-        sol = least_squares(residual_fun, x0)
-        x0 = sol.x
 
-        hist.append(x0)
+def batchKinematicsSim(sys, n_steps):
+    """
+    Same sweep as kinematicsSim, but every step is solved at once by the batched solver
+    Returns the Trajectory of the poses, starting with the initial state
+    """
+    x0 = sys.pack()
+    drive = drivePoses(sys, range(n_steps))
+
+    hist = Trajectory(sys, capacity=n_steps + 1)
+    hist.record()
+
+    compiled = sys.compiled
+    poses = np.repeat(compiled.buffer[None], n_steps, axis=0)
+    for body, p in drive.items():
+        poses[:,compiled.bodyIndex[body]] = p
+    poses[:,:compiled.nFree] = solveBatch(sys, drive, x0).reshape(n_steps, compiled.nFree, 7)
+    hist.extend(poses)
 
     return (hist)
     
@@ -94,7 +115,7 @@ def kinematicsSim(sys, n_steps):
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
 
-def plot_kinematics(sys, history, frame_names=None):
+def plot_kinematics(sys, history, frame_names=None, drive=None):
     """
     Visualize the multibody system frames over time.
 
@@ -102,10 +123,12 @@ def plot_kinematics(sys, history, frame_names=None):
     -----------
     sys : MultibodySystem
         The system object containing bodies and frames
-    history : list of np.array
-        List of solver state vectors (x) at each timestep
+    history : Trajectory or array
+        Trajectory returned by kinematicsSim, or a (steps, n_bodies, 7) pose stack (see MultibodySystem.historyPoses)
     frame_names : dict
         Optional mapping of frame objects to names for labeling
+    drive : dict
+        Optional driven body poses of a (steps, nState) state history (see MultibodySystem.historyPoses)
     """
 
     fig = plt.figure(figsize=(10, 8))
@@ -114,26 +137,26 @@ def plot_kinematics(sys, history, frame_names=None):
     # Collect colors for each body
     colors = ['red', 'blue', 'green', 'orange', 'purple']
 
+    # Global position of every frame at every step, (steps, frames, 3)
+    frames = [f for body in sys.bodies for f in body.frames]
+    positions = sys.framePositions(history, frames, drive)
+
+    i = 0
     for b_idx, body in enumerate(sys.bodies):
-        if body.fixed:
-            continue
         color = colors[b_idx % len(colors)]
 
         # Collect frame trajectories
-        for f in body.frames:
-            traj = []
-            for x in history:
-                sys.unpack(x)
-                pos = f.globalPosition()
-                traj.append(pos)
-            traj = np.array(traj)
-            ax.plot(traj[:,0], traj[:,1], traj[:,2], color=color, label=f"{body.name}-{body.frames.index(f)}")
+        for f_idx, f in enumerate(body.frames):
+            traj = positions[:, i]
+            i += 1
+            if not body.free:
+                continue
+            label = frame_names.get(f, f"{body.name}-{f_idx}") if frame_names else f"{body.name}-{f_idx}"
+            ax.plot(traj[:,0], traj[:,1], traj[:,2], color=color, label=label)
 
     # Optionally, mark the final position
-    for body in sys.bodies:
-        for f in body.frames:
-            pos = f.globalPosition()
-            ax.scatter(pos[0], pos[1], pos[2], color='k', s=20)
+    final = positions[-1]
+    ax.scatter(final[:,0], final[:,1], final[:,2], color='k', s=20)
 
     ax.set_xlabel("X")
     ax.set_ylabel("Y")
@@ -0,0 +1,184 @@
+import numpy as np
+from numpy.typing import NDArray
+from components import MultibodySystem, quatToMatrix
+
+
+#%%
+# Suspension Metrics Class
+
+class SuspensionMetrics:
+    """
+    Kinematic curves of a double wishbone corner, computed for every step of a solved trajectory at once.
+
+    Every point is expressed in chassis coordinates (x forward, y outboard for the left side, z up),
+    so heave, roll and pitch of the chassis are taken out. Angles are in degrees.
+
+    travel: wheel center z relative to the first step, positive in bump
+    camber: angle of the wheel plane from vertical, negative with the top inboard
+    toe: positive toe in
+    caster: kingpin axis angle in side view, positive with the top rearward
+    kpi: kingpin inclination in front view, positive with the top inboard
+    scrubRadius: lateral distance from the kingpin axis ground point to the contact patch, positive when the axis lands inboard
+    instantCenter: front view (y, z) intersection of the control arm lines
+    rollCenterHeight: height above the ground of the contact patch to instant center line at the centerline (y = 0)
+    springLength: ucaCoil to chasCoil distance
+    motionRatio: spring compression per unit wheel travel
+    camberGain, toeGain: derivatives with respect to wheel travel (degrees per unit travel)
+
+    The derivatives are taken with respect to the travel across the steps. Steps that repeat the travel of
+    the one before (e.g. kinematicsSim records the initial state and then solves step 0 at the same drive)
+    are left out of the differences and share the derivative of the sample they repeat, so the gains are
+    only nan when the travel never changes.
+    prefix is prepended to the frame and corner body names, e.g. "FL." for a corner of buildVehicle.
+    """
+
+    def __init__(self, sys: MultibodySystem, tireRadius: float, chassis: str = "chassis", upright: str = "upright",
+                 lca: str = "LCA", uca: str = "UCA", prefix: str = "") -> None:
+        self.sys = sys
+        self.tireRadius = tireRadius
+        compiled = sys._compiled()
+
+        points = {
+            "lowFor": ("chasLowFor", lca), "lowAft": ("chasLowAft", lca), "lowBJ": ("upriLowPnt", upright),
+            "uppFor": ("chasUppFor", uca), "uppAft": ("chasUppAft", uca), "uppBJ": ("upriUppPnt", upright),
+            "wheelCenter": ("wheelCenter", upright), "wheelAxis": ("wheelAxis", upright),
+            "ucaCoil": ("ucaCoil", uca), "chasCoil": ("chasCoil", chassis),
+        }
+        self.names = list(points)
+        self.index = np.array([
+            compiled.frameIndex[sys.getFrame(prefix + frame, body if body == chassis else prefix + body)]
+            for frame, body in points.values()
+        ])
+        self.chassis = compiled.bodyIndex[sys.getBody(chassis)]
+
+    @classmethod
+    def fromParams(cls, sys: MultibodySystem, params: dict, **names) -> "SuspensionMetrics":
+        """
+        Metrics for a corner built by buildDoubleWishbone, the tire radius is taken from tireDiam
+        """
+        return cls(sys, params["tireDiam"] / 2, **names)
+
+    def compute(self, history, frameLocal: NDArray | None = None, drive: dict | None = None) -> dict:
+        """
+        Metrics for every step of a history (see MultibodySystem.historyPoses, drive is passed to it)
+        frameLocal overrides the compiled frame table, e.g. with perturbed hardpoints
+        """
+        poses = self.sys.historyPoses(history, drive)
+        return self._evaluate(poses, poses[0], frameLocal)
+
+    def stream(self, history, chunkSize: int = 4096, drive: dict | None = None):
+        """
+        Yields the metrics chunk by chunk, e.g. over a memory mapped Trajectory
+        Each chunk is evaluated with one step of overlap on either side so the derivatives
+        match compute() exactly
+        """
+        poses = self.sys.historyPoses(history, drive)
+        n = len(poses)
+        reference = np.array(poses[0])
+        for start in range(0, n, chunkSize):
+            stop = min(start + chunkSize, n)
+            lo, hi = max(start - 1, 0), min(stop + 1, n)
+            chunk = self._evaluate(np.asarray(poses[lo:hi]), reference)
+            yield {name: value[start - lo:start - lo + stop - start] for name, value in chunk.items()}
+
+    def _points(self, poses: NDArray, frameLocal: NDArray | None = None) -> tuple:
+        """
+        The named points in chassis coordinates, and the ground normal (up) in chassis coordinates
+        """
+        P = self.sys.compiled.framePositions(poses, frameLocal, index=self.index)
+        rc = poses[:, self.chassis, :3]
+        Rc = quatToMatrix(poses[:, self.chassis, 3:])
+        local = np.einsum("nji,nkj->nki", Rc, P - rc[:,None,:])
+        up = Rc[:, 2, :]  # world z in chassis coordinates, the rows of Rc are the world axes
+        return {name: local[:, i] for i, name in enumerate(self.names)}, up
+
+    def _evaluate(self, poses: NDArray, reference: NDArray, frameLocal: NDArray | None = None) -> dict:
+        p, up = self._points(poses, frameLocal)
+        wc0 = self._points(reference[None], frameLocal)[0]["wheelCenter"][0]
+
+        wc = p["wheelCenter"]
+        side = np.sign(wc[:, 1])
+
+        # Wheel orientation, the axis points outboard and rises outboard with negative camber
+        a = _unit(p["wheelAxis"] - wc)
+        camber = -np.degrees(np.arcsin(a[:, 2]))
+        toe = np.degrees(np.arctan2(a[:, 0], np.abs(a[:, 1])))
+
+        # Kingpin axis
+        k = p["uppBJ"] - p["lowBJ"]
+        caster = np.degrees(np.arctan2(-k[:, 0], k[:, 2]))
+        kpi = np.degrees(np.arctan2(-side * k[:, 1], k[:, 2]))
+
+        # Contact patch, the lowest point of the wheel circle
+        down = -(up - np.sum(up * a, axis=-1)[:,None] * a)
+        contact = wc + self.tireRadius * _unit(down)
+
+        # Kingpin axis ground point
+        t = np.sum((contact - p["lowBJ"]) * up, axis=-1) / np.sum(k * up, axis=-1)
+        ground = p["lowBJ"] + t[:,None] * k
+        scrubRadius = side * (contact[:, 1] - ground[:, 1])
+
+        # Front view instant center and roll center
+        lower = _armLine(p["lowFor"], p["lowAft"], p["lowBJ"])
+        upper = _armLine(p["uppFor"], p["uppAft"], p["uppBJ"])
+        ic = _intersect(*lower, *upper)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            slope = (ic[:, 1] - contact[:, 2]) / (ic[:, 0] - contact[:, 1])
+        rollCenterHeight = slope * (0 - contact[:, 1])
+
+        # Spring
+        springLength = np.linalg.norm(p["ucaCoil"] - p["chasCoil"], axis=-1)
+
+        travel = wc[:, 2] - wc0[2]
+        motionRatio = -_derivative(springLength, travel)
+        camberGain = _derivative(camber, travel)
+        toeGain = _derivative(toe, travel)
+
+        return {
+            "travel": travel,
+            "camber": camber,
+            "toe": toe,
+            "caster": caster,
+            "kpi": kpi,
+            "scrubRadius": scrubRadius,
+            "instantCenter": ic,
+            "rollCenterHeight": rollCenterHeight,
+            "springLength": springLength,
+            "motionRatio": motionRatio,
+            "camberGain": camberGain,
+            "toeGain": toeGain,
+        }
+
+
+def _unit(v: NDArray) -> NDArray:
+    return v / np.linalg.norm(v, axis=-1)[...,None]
+
+def _derivative(y: NDArray, x: NDArray, tol: float = 1e-12) -> NDArray:
+    """
+    dy/dx along the samples by central differences (one sided at the ends), skipping samples that repeat
+    the x of the sample before, which take the derivative of that sample. nan if x never changes
+    """
+    keep = np.concatenate([[True], np.abs(np.diff(x)) > tol * max(1.0, np.max(np.abs(x), initial=0))])
+    if np.sum(keep) < 2:
+        return np.full_like(y, np.nan)
+    return np.gradient(y[keep], x[keep])[np.cumsum(keep) - 1]
+
+def _armLine(fore: NDArray, aft: NDArray, balljoint: NDArray) -> tuple:
+    """
+    Front view (y, z) line of a control arm: through the ball joint and the point of the pivot axis
+    at the ball joint's x
+    """
+    t = (balljoint[:, 0] - fore[:, 0]) / (aft[:, 0] - fore[:, 0])
+    pivot = fore + t[:,None] * (aft - fore)
+    return pivot[:, 1:], balljoint[:, 1:]
+
+def _intersect(a1: NDArray, a2: NDArray, b1: NDArray, b2: NDArray) -> NDArray:
+    """
+    Intersection of the 2D lines a1-a2 and b1-b2, inf where they are parallel
+    """
+    da, db = a2 - a1, b2 - b1
+    cross = da[:, 0] * db[:, 1] - da[:, 1] * db[:, 0]
+    w = b1 - a1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = (w[:, 0] * db[:, 1] - w[:, 1] * db[:, 0]) / cross
+    return a1 + t[:,None] * da
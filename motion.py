@@ -0,0 +1,103 @@
+import numpy as np
+from numpy.typing import NDArray
+from components import quatToMatrix, quatMultiply, quatFromAxisAngle
+
+
+#%%
+# Motion Profile Class
+
+class MotionProfile:
+    """
+    Prescribed poses of a driven body, sampled over a whole sweep.
+
+    poses[k] is the [r, q] of the body at step k. A profile is a drop in for the heave_motion style
+    callables of Body.setMotion: calling it with an integer step returns that sample, other steps
+    (continuation and adaptive sweeps) interpolate linearly between samples with q renormalized.
+    The sweeps read the whole array at once through motionPoses, so no Python call is made per step.
+
+    Steps outside the sampled range raise, the profile has to cover the sweep.
+    """
+
+    def __init__(self, poses: NDArray | list) -> None:
+        self.poses = np.array(poses, dtype=float).reshape(-1, 7)
+        self.poses[:,3:] /= np.linalg.norm(self.poses[:,3:], axis=-1, keepdims=True)
+        self.poses.flags.writeable = False
+
+    @classmethod
+    def fromArrays(cls, r: NDArray | list = (0, 0, 0), q: NDArray | list = (1, 0, 0, 0)) -> "MotionProfile":
+        """
+        Profile from positions (N, 3) and quaternions (N, 4), either may be a single constant value
+        """
+        r = np.asarray(r, dtype=float).reshape(-1, 3)
+        q = np.asarray(q, dtype=float).reshape(-1, 4)
+        n = max(len(r), len(q))
+        return cls(np.concatenate([np.broadcast_to(r, (n, 3)), np.broadcast_to(q, (n, 4))], axis=-1))
+
+    def __len__(self) -> int:
+        return len(self.poses)
+
+    def __call__(self, step: float) -> tuple:
+        pose = self.posesAt([step])[0]
+        return pose[:3], pose[3:]
+
+    def posesAt(self, steps) -> NDArray:
+        """
+        (N, 7) poses at the steps, indexed directly when every step is a sample
+        """
+        steps = np.asarray(steps, dtype=float).reshape(-1)
+        n = len(self.poses)
+        # A small margin lets motionDerivative difference across the first and last sample
+        if np.any(steps < -1e-3) or np.any(steps > n - 1 + 1e-3):
+            raise ValueError(f"Steps {steps.min()} to {steps.max()} are outside the profile's {n} samples")
+
+        index = np.rint(steps).astype(int)
+        if np.all(index == steps):
+            return self.poses[index].copy()
+
+        i = np.clip(np.floor(steps).astype(int), 0, max(n - 2, 0))
+        t = (steps - i)[:,None]
+        j = np.minimum(i + 1, n - 1)
+        poses = (1 - t) * self.poses[i] + t * self.poses[j]
+        poses[:,3:] /= np.linalg.norm(poses[:,3:], axis=-1, keepdims=True)
+        return poses
+
+
+#%%
+# Drive input builders
+
+def chassisMotion(heave: NDArray | float = 0.0, roll: NDArray | float = 0.0, pitch: NDArray | float = 0.0,
+                  yaw: NDArray | float = 0.0, pivot: NDArray | list = (0, 0, 0)) -> MotionProfile:
+    """
+    Chassis profile from heave (along z) and roll, pitch, yaw in degrees, right handed about the chassis
+    x, y and z axes through pivot (in chassis coordinates) and applied in that order. Arrays are sampled
+    per step and broadcast together, e.g. chassisMotion(heave=np.linspace(0, 2, 21), roll=1.5)
+    """
+    heave, roll, pitch, yaw = np.broadcast_arrays(*[np.atleast_1d(np.asarray(v, dtype=float))
+                                                    for v in (heave, roll, pitch, yaw)])
+    q = quatFromAxisAngle([0, 0, 1], np.radians(yaw))
+    q = quatMultiply(q, quatFromAxisAngle([0, 1, 0], np.radians(pitch)))
+    q = quatMultiply(q, quatFromAxisAngle([1, 0, 0], np.radians(roll)))
+    pivot = np.asarray(pivot, dtype=float)
+    r = pivot - np.einsum("nij,j->ni", quatToMatrix(q), pivot)
+    r[:,2] += heave
+    return MotionProfile.fromArrays(r, q)
+
+
+def rackMotion(travel: NDArray | float, chassis: MotionProfile | None = None,
+               axis: NDArray | list = [0, 1, 0]) -> MotionProfile:
+    """
+    Steering rack profile, translating by travel along axis in chassis coordinates while carried
+    by the chassis profile (default: a chassis at rest), e.g. rackMotion(steer, chassis=heaveRoll)
+    """
+    chassis = chassis or MotionProfile.fromArrays()
+    travel = np.atleast_1d(np.asarray(travel, dtype=float))
+    n = max(len(travel), len(chassis))
+    travel = np.broadcast_to(travel, (n,))
+    c = np.broadcast_to(chassis.poses, (n, 7)) if len(chassis) == 1 else chassis.poses
+    if len(c) != n:
+        raise ValueError(f"The rack travel has {len(travel)} samples but the chassis profile {len(c)}")
+
+    offset = travel[:,None] * np.asarray(axis, dtype=float)
+    r = c[:,:3] + np.einsum("nij,nj->ni", quatToMatrix(c[:,3:]), offset)
+    return MotionProfile.fromArrays(r, c[:,3:])
+
@@ -0,0 +1,132 @@
+import numpy as np
+from numpy.typing import NDArray
+from collections import OrderedDict
+from scipy.optimize import least_squares
+from components import MultibodySystem
+from sensitivity import Sensitivity
+from suspension_util import AXES
+
+
+#%%
+# Hardpoint Optimizer Class
+
+class HardpointOptimizer:
+    """
+    Moves hardpoints so the kinematic curves of a sweep match target curves.
+
+    The objective is the weighted difference between metrics (see SuspensionMetrics) and their targets at
+    every step of the sweep, minimized with scipy's least_squares. The jacobian comes from Sensitivity,
+    so a design costs one sweep plus back substitutions instead of a sweep per hardpoint coordinate.
+    Every sweep starts from the trajectory of the last evaluated design, and evaluated designs are
+    cached so the residual and jacobian of a design share one sweep.
+
+    :param metrics: SuspensionMetrics of sys
+    :param targets: {metric: target}, the target is a value, a curve over the sweep (n_steps+1,)
+                    or a callable of the wheel travel, e.g. {"toe": 0, "camberGain": lambda travel: -0.8}
+    :param hardpoints: Hardpoint names (all three coordinates) or (name, axis) pairs to optimize,
+                       defaults to every design variable
+    :param steps: Steps of the sweep, passed to the driven bodies' motions
+    :param weights: {metric: weight}, default 1
+    :param maxMove: Bound on how far each coordinate may move from its starting value
+    :param cacheSize: Number of evaluated designs kept
+    """
+
+    def __init__(self, sys: MultibodySystem, metrics, targets: dict, hardpoints: list | None = None,
+                 steps=range(20), weights: dict | None = None, maxMove: float = np.inf, cacheSize: int = 32) -> None:
+        self.sys = sys
+        self.metrics = metrics
+        self.targets = targets
+        self.weights = {name: 1.0 for name in targets} | (weights or {})
+        self.steps = list(steps)
+        self.sensitivity = Sensitivity(sys)
+
+        names = self.sensitivity.names
+        if hardpoints is None:
+            hardpoints = names
+        self.columns = []
+        for h in hardpoints:
+            name, axes = (h, "xyz") if isinstance(h, str) else h
+            if name not in names:
+                raise KeyError(f"{name} is not a design variable of the system")
+            self.columns += [3 * names.index(name) + AXES[a] for a in axes]
+        self.columns = np.array(self.columns, dtype=int)
+
+        # The sweep always starts from the assembly, where every design is assembled
+        compiled = sys._compiled()
+        self.p0 = self.sensitivity.parameters
+        self._assembly = compiled.buffer.copy()
+        self.bounds = (self.p0[self.columns] - maxMove, self.p0[self.columns] + maxMove)
+
+        self._cache = OrderedDict()
+        self._cacheSize = cacheSize
+        self._warm = None
+        self._mask = None
+        self.stats = {"sweeps": 0, "cacheHits": 0}
+
+    def parameters(self, z: NDArray) -> NDArray:
+        """
+        Full hardpoint vector from the optimized coordinates
+        """
+        p = self.p0.copy()
+        p[self.columns] = z
+        return p
+
+    def evaluate(self, z: NDArray) -> tuple:
+        """
+        Sweeps the design z (the optimized coordinates) and returns (residual, jacobian, history)
+        """
+        key = np.asarray(z, dtype=float).tobytes()
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.stats["cacheHits"] += 1
+            return self._cache[key]
+
+        sys = self.sys
+        S = self.sensitivity
+        S.setParameters(self.parameters(z))
+        sys.poses()[...] = self._assembly
+        history, dX = S.sweep(self.steps, self._warm)
+        self._warm = np.array(history.states)
+        self.stats["sweeps"] += 1
+
+        values = self.metrics.compute(history)
+        slopes = S.metricSensitivity(self.metrics, history, dX, columns=self.columns)
+
+        residual, jacobian = [], []
+        for name, target in self.targets.items():
+            if callable(target):
+                target = target(values["travel"])
+            w = self.weights[name]
+            residual.append(np.ravel(w * (values[name] - target)))
+            jacobian.append(w * slopes[name].reshape(-1, len(self.columns)))
+        residual = np.concatenate(residual)
+        jacobian = np.concatenate(jacobian)
+
+        # Entries that are undefined at the start (e.g. gains where the travel is stationary) are left out
+        if self._mask is None:
+            self._mask = np.isfinite(residual)
+        residual = np.nan_to_num(residual[self._mask])
+        jacobian = np.nan_to_num(jacobian[self._mask])
+
+        result = (residual, jacobian, history)
+        self._cache[key] = result
+        if len(self._cache) > self._cacheSize:
+            self._cache.popitem(last=False)
+        return result
+
+    def run(self, **options) -> tuple:
+        """
+        Runs the optimization, options are passed to scipy.optimize.least_squares
+        The system is left at the optimized hardpoints
+        :return: (hardpoints, result), {name: [x, y, z]} of the optimized design and the least_squares result
+        """
+        z0 = self.p0[self.columns]
+        result = least_squares(
+            lambda z: self.evaluate(z)[0], z0, jac=lambda z: self.evaluate(z)[1],
+            bounds=self.bounds, **options
+        )
+        p = self.parameters(result.x)
+        self._cache.pop(np.asarray(result.x, dtype=float).tobytes(), None)
+        self.evaluate(result.x)
+        names = self.sensitivity.names
+        return {name: p[3*i:3*i + 3] for i, name in enumerate(names)}, result
@@ -0,0 +1,188 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from numpy.typing import NDArray
+from components import MultibodySystem
+from solver import NewtonSolver, applyDrive
+from motion import chassisMotion, rackMotion
+from trajectory import appendNpy
+
+
+CHANNELS = ("travel", "heave", "roll", "pitch", "rack")
+
+
+#%%
+# Signal input
+
+def readSignal(source, chunkSize: int = 65536, columns: list | None = None):
+    """
+    Yields a drive signal chunk by chunk as (k, n_columns) arrays
+
+    :param source: A .csv file (read by pandas in chunks), a .npy file (memory mapped) or an array
+    :param columns: Columns to read, names or indices for a CSV and indices otherwise. Defaults to all of them
+    """
+    if isinstance(source, str) and source.endswith(".csv"):
+        for frame in pd.read_csv(source, chunksize=chunkSize, usecols=columns):
+            yield frame.to_numpy(dtype=float).reshape(len(frame), -1)
+        return
+
+    data = np.load(source, mmap_mode="r") if isinstance(source, str) else np.asarray(source)
+    data = data.reshape(len(data), -1)
+    for start in range(0, len(data), chunkSize):
+        chunk = data[start:start + chunkSize]
+        yield np.array(chunk if columns is None else chunk[:, columns], dtype=float)
+
+
+#%%
+# Road Profile Driver Class
+
+class RoadProfileDriver:
+    """
+    Replays a measured trace through the model with bounded memory.
+
+    The trace is read chunk by chunk, every sample is solved warm started from the previous one and the
+    poses (and metrics) are appended to .npy stores chunk by chunk, so memory does not grow with the trace.
+    Each column of the signal is a channel, mapped onto the driven bodies through motion.py profiles:
+
+    travel: wheel travel, the chassis moves down by it while the wheel stays on the ground
+    heave: chassis heave, roll, pitch: chassis angles in degrees (see chassisMotion)
+    rack: rack travel, needs a "rack" body (buildDoubleWishbone(rack=True))
+
+    The channels replace the chassis' and rack's own motions. Missing channels are zero.
+
+    :param metrics: Optional SuspensionMetrics evaluated on the fly. The derivatives of a chunk need the
+                    first sample of the next one, so a chunk's metrics are reported once that one is solved
+    :param solver: Solver for every sample, defaults to a NewtonSolver reusing its factorization
+    """
+
+    def __init__(self, sys: MultibodySystem, channels: tuple = ("travel",), metrics=None,
+                 solver: NewtonSolver | None = None, chunkSize: int = 65536) -> None:
+        for name in channels:
+            if name not in CHANNELS:
+                raise ValueError(f"Unknown channel {name}, expected one of {CHANNELS}")
+
+        self.sys = sys
+        self.channels = tuple(channels)
+        self.metrics = metrics
+        self.solver = solver or NewtonSolver(sys, reuse=True)
+        self.chunkSize = chunkSize
+
+        self.chassis = sys.getBody("chassis")
+        self.rack = sys.getBody("rack") if "rack" in [b.name for b in sys.bodies] else None
+        if "rack" in self.channels and self.rack is None:
+            raise KeyError("The rack channel needs a body named rack.")
+
+    def drive(self, signal: NDArray) -> dict:
+        """
+        {body: (k, 7) poses} of the driven bodies for a chunk of the signal
+        """
+        channel = {name: signal[:, i] for i, name in enumerate(self.channels)}
+        zero = np.zeros(len(signal))
+        chassis = chassisMotion(heave=channel.get("heave", zero) - channel.get("travel", zero),
+                                roll=channel.get("roll", zero), pitch=channel.get("pitch", zero))
+        drive = {self.chassis: chassis.poses}
+        if self.rack is not None:
+            drive[self.rack] = rackMotion(channel.get("rack", zero), chassis=chassis).poses
+        return drive
+
+    def stream(self, source, path: str | None = None, metricsPath: str | None = None, columns: list | None = None):
+        """
+        Generator over the replay, yields a report per chunk of the signal:
+        {"start", "stop": sample range of the chunk, "samples": samples solved so far, "failed": samples that
+         did not converge so far (stored as nan), "elapsed": seconds, "rate": samples per second,
+         "metrics": {name: values} of the chunk or None}
+        samples, failed, elapsed and rate are taken when the chunk finished solving, the report itself may come
+        a chunk later (see metrics)
+
+        :param path: .npy store of the poses, one row per sample (see Trajectory.load), replaced if it exists
+        :param metricsPath: .npy store of the metrics, a structured array with a field per metric
+        """
+        sys = self.sys
+        compiled = sys._compiled()
+        for p in (path, metricsPath):
+            if p is not None and os.path.exists(p):
+                os.remove(p)
+
+        t0 = time.perf_counter()
+        samples, failed = 0, 0
+        pending = None  # (start, poses, progress) of the last chunk, its metrics wait for the next chunk's first sample
+        before = None   # last sample of the chunk before it
+        reference = None
+
+        def report(start, poses, progress, after):
+            metrics = None
+            if self.metrics is not None:
+                metrics = self._metrics(poses, before, after, reference)
+                if metricsPath is not None:
+                    appendNpy(metricsPath, _records(metrics))
+            return {"start": start, "stop": start + len(poses)} | progress | {"metrics": metrics}
+
+        for signal in readSignal(source, self.chunkSize, columns):
+            drive = self.drive(signal)
+            poses = np.empty((len(signal),) + compiled.buffer.shape)
+            x = sys.pack()
+            for k in range(len(signal)):
+                applyDrive(sys, drive, k)
+                try:
+                    x = self.solver.solve(x)
+                    poses[k] = compiled.buffer
+                except (RuntimeError, np.linalg.LinAlgError):
+                    sys.unpack(x)
+                    poses[k] = np.nan
+                    failed += 1
+
+            if path is not None:
+                appendNpy(path, poses.reshape(len(poses), -1))
+            if reference is None:
+                reference = poses[0].copy()
+
+            start = samples
+            samples += len(signal)
+            elapsed = time.perf_counter() - t0
+            progress = {"samples": samples, "failed": failed, "elapsed": elapsed,
+                        "rate": samples / elapsed if elapsed > 0 else np.inf}
+
+            if pending is not None:
+                yield report(*pending, poses[0])
+                before = pending[1][-1]
+            pending = (start, poses, progress)
+
+        if pending is not None:
+            yield report(*pending, None)
+
+    def run(self, source, path: str | None = None, metricsPath: str | None = None, columns: list | None = None,
+            verbose: bool = True) -> dict:
+        """
+        Runs the whole replay, printing the throughput after every chunk with verbose
+        :return: The last report
+        """
+        last = None
+        for last in self.stream(source, path, metricsPath, columns):
+            if verbose:
+                print(f"{last['samples']} samples, {last['rate']:.0f} samples/s, {last['failed']} failed")
+        return last
+
+    def _metrics(self, poses: NDArray, before: NDArray | None, after: NDArray | None, reference: NDArray) -> dict:
+        """
+        Metrics of a chunk, evaluated with its neighbouring samples so the derivatives match compute()
+        """
+        block = [poses]
+        if before is not None:
+            block.insert(0, before[None])
+        if after is not None:
+            block.append(after[None])
+        values = self.metrics._evaluate(np.concatenate(block), reference)
+        lo = 0 if before is None else 1
+        return {name: v[lo:lo + len(poses)] for name, v in values.items()}
+
+
+def _records(metrics: dict) -> NDArray:
+    """
+    Structured array with a field per metric, e.g. instantCenter is a (2,) field
+    """
+    n = len(next(iter(metrics.values())))
+    records = np.empty(n, dtype=[(name, float, v.shape[1:]) for name, v in metrics.items()])
+    for name, v in metrics.items():
+        records[name] = v
+    return records
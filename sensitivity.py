@@ -0,0 +1,156 @@
+import numpy as np
+from numpy.typing import NDArray
+from components import MultibodySystem
+from solver import NewtonSolver, drivePoses, applyDrive
+from trajectory import Trajectory
+
+
+# Frames that are not design variables themselves but are placed relative to a hardpoint by the builders,
+# {frame name: hardpoint name}. buildDoubleWishbone puts wheelAxis at wheelCenter + axis, and the ground
+# under a tire at the wheel center's contact point. Prefixed names ("FL.wheelAxis") follow the prefixed hardpoint
+FOLLOW = {"wheelAxis": "wheelCenter", "ground": "wheelCenter"}
+
+
+def _follows(name: str | None, follow: dict) -> str | None:
+    if name is None:
+        return None
+    prefix, _, base = name.rpartition(".")
+    if name in follow or base not in follow:
+        return follow.get(name)
+    return f"{prefix}.{follow[base]}"
+
+
+#%%
+# Sensitivity Class
+
+class Sensitivity:
+    """
+    Derivatives of the solved configuration with respect to the hardpoints, by implicit differentiation.
+
+    The parameters are the coordinates of the designVariable frames. Frames that share a name share a
+    hardpoint (a spherical joint's two frames), so they move together, as do the frames in follow.
+    parameters is the flat vector [x, y, z] of every hardpoint in the order of names.
+
+    At a solution Phi(x, p) = 0, so J dx/dp = -dPhi/dp with dPhi/dp = dPhi/ds G, the derivative with
+    respect to the frames' local offsets (CompiledSystem.offsetJacobian) mapped onto the hardpoints.
+    The solve uses the solver's factorization at the solution, so every hardpoint costs a back substitution.
+    """
+
+    def __init__(self, sys: MultibodySystem, solver: NewtonSolver | None = None, follow: dict | None = None) -> None:
+        compiled = sys._compiled()
+        self.sys = sys
+        self.solver = solver or NewtonSolver(sys, reuse=True)
+        follow = FOLLOW if follow is None else follow
+
+        self.names = list(dict.fromkeys(f.name for f in compiled.frames if f.designVariable))
+        if None in self.names:
+            raise RuntimeError("Every designVariable frame needs a name to be grouped into hardpoints.")
+        hardpoint = {name: i for i, name in enumerate(self.names)}
+
+        # G maps the hardpoint coordinates onto the local offset of every frame
+        self.G = np.zeros((3 * len(compiled.frames), 3 * len(self.names)))
+        self._frames = []
+        for i, f in enumerate(compiled.frames):
+            h = f.name if f.designVariable else _follows(f.name, follow)
+            if h in hardpoint:
+                self.G[3*i:3*i + 3, 3*hardpoint[h]:3*hardpoint[h] + 3] = np.eye(3)
+                if f.designVariable:
+                    self._frames.append((i, hardpoint[h]))
+
+    @property
+    def parameters(self) -> NDArray:
+        """
+        Current hardpoint coordinates, read from the first frame of each hardpoint
+        """
+        p = np.empty(3 * len(self.names))
+        for i, h in self._frames:
+            p[3*h:3*h + 3] = self.sys.compiled.frameLocal[i]
+        return p
+
+    def frameLocal(self, parameters: NDArray) -> NDArray:
+        """
+        Frame table with the hardpoints moved to parameters, frames that follow a hardpoint keep their offset
+        """
+        compiled = self.sys._compiled()
+        delta = self.G @ (np.asarray(parameters, dtype=float) - self.parameters)
+        return compiled.frameLocal + delta.reshape(-1, 3)
+
+    def setParameters(self, parameters: NDArray) -> None:
+        """
+        Moves the hardpoints of the system (in place, through the compiled frame table)
+        """
+        compiled = self.sys._compiled()
+        compiled.frameLocal[...] = self.frameLocal(parameters)
+
+    def parameterJacobian(self, poses: NDArray | None = None) -> NDArray:
+        """
+        dPhi/dp at the given poses (default: the current configuration), (nResiduals, n_parameters)
+        """
+        compiled = self.sys._compiled()
+        poses = compiled.buffer if poses is None else poses
+        return compiled.offsetJacobian(poses) @ self.G
+
+    def stateSensitivity(self) -> NDArray:
+        """
+        dx/dp at the current (solved) configuration, (nState, n_parameters)
+        """
+        return -self.solver.linearSolve(self.parameterJacobian())
+
+    def sweep(self, steps, x0: NDArray | None = None) -> tuple:
+        """
+        Solves the driven bodies' motions over steps (like kinematicsSim) with the state sensitivity at every step
+        The current configuration is solved first (it is already assembled unless the hardpoints moved)
+
+        :param x0: Optional initial guesses for every point of the sweep, (n_steps+1, nState),
+                   e.g. the trajectory of a nearby design. By default each step starts from the previous one
+        :return: (trajectory, dX), the Trajectory starting with the current state and dX (n_steps+1, nState, n_parameters)
+        """
+        sys = self.sys
+        compiled = sys._compiled()
+        steps = list(steps)
+        drive = drivePoses(sys, steps)
+
+        hist = Trajectory(sys, capacity=len(steps) + 1)
+        dX = np.empty((len(steps) + 1, compiled.nState, len(self.G.T)))
+
+        self.solver.solve(None if x0 is None else x0[0])
+        hist.record()
+        dX[0] = self.stateSensitivity()
+        for k in range(len(steps)):
+            applyDrive(sys, drive, k)
+            self.solver.solve(None if x0 is None else x0[k+1])
+            hist.record()
+            dX[k+1] = self.stateSensitivity()
+
+        return hist, dX
+
+    def metricSensitivity(self, metrics, history, dX: NDArray, h: float = 1e-6, columns=None,
+                          drive: dict | None = None) -> dict:
+        """
+        d(metric)/dp at every step for a SuspensionMetrics (or anything with compute(history, frameLocal))
+        Each parameter moves the states along dX and the frames along G together. dX is the exact implicit
+        derivative, but the metric formulas themselves are not differentiated analytically: the metrics are
+        differentiated along that direction by central finite differences over the whole history at once,
+        two compute() calls per parameter. The error is O(h^2) from truncation plus about eps / h from round
+        off, the default h = 1e-6 (inches, about eps^(1/3) for unit scale coordinates) balances the two
+        (changing h by 10x moves the slopes by about 1e-7). The gains are derivatives along the sweep, so their sensitivities carry
+        that differencing as well
+
+        :param columns: Parameter indices to differentiate, defaults to all of them
+        :param drive: Driven body poses of a state history, see MultibodySystem.historyPoses
+        :return: {name: (n_steps, ..., n_columns)}
+        """
+        compiled = self.sys._compiled()
+        poses = np.array(self.sys.historyPoses(history, drive))
+        nFree = compiled.nFree
+
+        slopes = []
+        for j in range(dX.shape[-1]) if columns is None else columns:
+            dPoses = np.zeros_like(poses)
+            dPoses[:,:nFree] = dX[...,j].reshape(len(poses), nFree, 7)
+            ds = self.G[:,j].reshape(-1, 3)
+            hi = metrics.compute(poses + h * dPoses, compiled.frameLocal + h * ds)
+            lo = metrics.compute(poses - h * dPoses, compiled.frameLocal - h * ds)
+            slopes.append({name: (hi[name] - lo[name]) / (2 * h) for name in hi})
+
+        return {name: np.stack([c[name] for c in slopes], axis=-1) for name in slopes[0]}
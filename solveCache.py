@@ -0,0 +1,194 @@
+import numpy as np
+from numpy.typing import NDArray
+import os
+import glob
+import hashlib
+from collections import OrderedDict
+from components import MultibodySystem, Tire
+from solver import drivePoses
+from trajectory import Trajectory
+import kinematicsSim as sim
+
+
+#%%
+# Model hashing
+# Keys are short sha256 digests of a canonical serialization, so they are stable across sessions
+
+def digest(*parts) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(str(part.shape).encode())
+            h.update(np.ascontiguousarray(part, dtype=float).tobytes())
+        else:
+            h.update(str(part).encode())
+        h.update(b"|")
+    return h.hexdigest()[:16]
+
+def topologyKey(sys: MultibodySystem) -> str:
+    """
+    Hash of the model structure: bodies, frames and joints, without any coordinates
+    """
+    compiled = sys._compiled()
+    parts = []
+    for b in compiled.bodies:
+        parts.append((type(b).__name__, b.name, b.free, [(f.name, f.designVariable) for f in b.frames]))
+    for j in sys.joints:
+        parts.append((type(j).__name__, compiled.frameIndex[j.frame1], compiled.frameIndex[j.frame2]))
+    return digest(*parts)
+
+def valueKey(sys: MultibodySystem) -> str:
+    """
+    Hash of the model's values: hardpoints (frame table), starting poses, joint and tire parameters
+    """
+    compiled = sys._compiled()
+    parts = [compiled.frameLocal, compiled.buffer]
+    parts += [np.asarray(j.parameters(), dtype=float) for j in sys.joints]
+    parts += [np.array([b.OD, b.ID, b.width]) for b in compiled.bodies if isinstance(b, Tire)]
+    return digest(*parts)
+
+def driveKey(sys: MultibodySystem, n_steps: int) -> str:
+    """
+    Hash of the motion specification, the poses every driven body goes through
+    """
+    parts = [n_steps, sim.SOLVER]
+    for b, poses in drivePoses(sys, range(n_steps)).items():
+        parts += [b.name, poses]
+    return digest(*parts)
+
+
+#%%
+# Solve Cache Class
+
+class SolveCache:
+    """
+    Content addressed cache of kinematicsSim results.
+
+    A sweep is keyed by the model topology, its values (hardpoints, starting poses, parameters) and the
+    drive (the motion of every driven body over the steps). Results are kept in an in-memory LRU and,
+    with a directory, in .npz files named <topology>_<drive>_<values>.npz. The disk tier evicts the least
+    recently used files once it exceeds maxBytes.
+
+    A near miss, the same topology and drive with different values (e.g. moved hardpoints), is solved
+    with the stored sweep closest in hardpoints as the initial guess for every step.
+
+    stats counts the memory hits, disk hits, near misses and misses.
+    """
+
+    def __init__(self, directory: str | None = None, maxEntries: int = 32, maxBytes: int = 1 << 30) -> None:
+        self.directory = directory
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self._memory = OrderedDict()
+        self.stats = {"memoryHits": 0, "diskHits": 0, "nearMisses": 0, "misses": 0}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def keys(self, sys: MultibodySystem, n_steps: int) -> tuple:
+        return topologyKey(sys), driveKey(sys, n_steps), valueKey(sys)
+
+    def kinematicsSim(self, sys: MultibodySystem, n_steps: int, path: str | None = None) -> Trajectory:
+        """
+        kinematicsSim through the cache. Like kinematicsSim the system is left at the last step
+        """
+        key = self.keys(sys, n_steps)
+        poses = self._lookup(key)
+        if poses is not None:
+            hist = Trajectory(sys, capacity=len(poses), path=path)
+            hist.extend(poses)
+            hist.flush()
+            sys.poses()[...] = poses[-1]
+            return hist
+
+        compiled = sys._compiled()
+        guess = self._nearest(key, compiled.frameLocal, compiled.nState)
+        if guess is None:
+            self.stats["misses"] += 1
+        else:
+            self.stats["nearMisses"] += 1
+        frameLocal = compiled.frameLocal.copy()
+
+        hist = sim.kinematicsSim(sys, n_steps, path=path, guess=guess)
+        self._store(key, np.array(hist.poses), frameLocal)
+        return hist
+
+    #%%
+    # Tiers
+
+    def _lookup(self, key: tuple) -> NDArray | None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats["memoryHits"] += 1
+            return self._memory[key][0]
+
+        file = self._file(key)
+        if file is not None and os.path.exists(file):
+            with np.load(file) as data:
+                poses, frameLocal = data["poses"], data["frameLocal"]
+            os.utime(file)
+            self._remember(key, poses, frameLocal)
+            self.stats["diskHits"] += 1
+            return poses
+        return None
+
+    def _nearest(self, key: tuple, frameLocal: NDArray, nState: int) -> NDArray | None:
+        """
+        States of the stored sweep with the same topology and drive whose hardpoints are closest
+        """
+        candidates = [(k[2], v[1], lambda v=v: v[0]) for k, v in self._memory.items() if k[:2] == key[:2]]
+        if self.directory is not None:
+            for file in glob.glob(os.path.join(self.directory, f"{key[0]}_{key[1]}_*.npz")):
+                values = os.path.basename(file)[:-4].split("_")[2]
+                if any(values == c[0] for c in candidates):
+                    continue
+                with np.load(file) as data:
+                    candidates.append((values, data["frameLocal"], lambda file=file: np.load(file)["poses"]))
+
+        candidates = [c for c in candidates if c[1].shape == frameLocal.shape]
+        if not candidates:
+            return None
+        _, _, poses = min(candidates, key=lambda c: np.linalg.norm(c[1] - frameLocal))
+        # The free bodies come first in every pose row, so their states are the first nState entries
+        poses = poses()
+        return poses.reshape(len(poses), -1)[:, :nState]
+
+    def _store(self, key: tuple, poses: NDArray, frameLocal: NDArray) -> None:
+        self._remember(key, poses, frameLocal)
+        file = self._file(key)
+        if file is None:
+            return
+        # Written under a temporary name first, so a partial file is never picked up
+        tmp = file + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, poses=poses, frameLocal=frameLocal)
+        os.replace(tmp, file)
+        self._evict()
+
+    def _remember(self, key: tuple, poses: NDArray, frameLocal: NDArray) -> None:
+        self._memory[key] = (poses, frameLocal)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxEntries:
+            self._memory.popitem(last=False)
+
+    def _file(self, key: tuple) -> str | None:
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, "_".join(key) + ".npz")
+
+    def _evict(self) -> None:
+        """
+        Deletes the least recently used files until the directory fits in maxBytes
+        """
+        files = [(os.stat(f), f) for f in glob.glob(os.path.join(self.directory, "*.npz"))]
+        total = sum(s.st_size for s, _ in files)
+        for s, f in sorted(files, key=lambda x: x[0].st_mtime):
+            if total <= self.maxBytes:
+                break
+            os.remove(f)
+            total -= s.st_size
+
+    def clear(self) -> None:
+        self._memory.clear()
+        if self.directory is not None:
+            for f in glob.glob(os.path.join(self.directory, "*.npz")):
+                os.remove(f)
@@ -0,0 +1,574 @@
+import numpy as np
+from numpy.typing import NDArray
+from scipy.interpolate import CubicSpline
+from scipy.optimize import least_squares
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from scipy.sparse.linalg import splu
+from components import MultibodySystem
+from trajectory import Trajectory
+
+
+#%%
+# Newton Solver Class
+
+class NewtonSolver:
+    """
+    Damped Gauss-Newton solver for the constraint equations of a MultibodySystem.
+
+    Each step solves the normal equations J^T J dx = -J^T Phi with a sparse LU. The sparsity pattern of
+    J never changes, so the fill reducing (RCM) ordering is computed once and reused for every factorization.
+    Only the ordering is reused: SciPy's splu has no way to keep a symbolic factorization, so every
+    factorization redoes its symbolic analysis (with the NATURAL column order, on the already permuted matrix).
+    The normal equations square the condition number of J, which is fine for these small, well posed
+    systems; the batched solver (_gaussNewton) factors J itself with a QR.
+    With reuse=True the numeric factorization (and the jacobian it came from) is also kept across
+    iterations and solves (modified Newton). It is only refreshed when the residual stops contracting
+    by at least the contraction ratio, or when a stale step fails to reduce the residual.
+    Steps are halved until the residual norm decreases.
+
+    backend="least_squares" hands the problem to scipy.optimize.least_squares with the analytic jacobian instead.
+
+    coordinates="rotationVector" steps in the tangent space of the free bodies (6 per body, see
+    CompiledSystem.tangentJacobian and retract) instead of their 7 pose coordinates. The quaternion
+    normalization rows drop out, so the system is smaller and better conditioned. States and linearSolve
+    results are still in pose coordinates.
+
+    stats counts the iterations, jacobian evaluations / factorizations and solves since construction.
+    """
+
+    BACKENDS = ("newton", "least_squares")
+    COORDINATES = ("quaternion", "rotationVector")
+
+    def __init__(self, sys: MultibodySystem, tol: float = 1e-10, maxIter: int = 20, reuse: bool = False,
+                 contraction: float = 0.25, maxHalvings: int = 8, backend: str = "newton",
+                 coordinates: str = "quaternion") -> None:
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {self.BACKENDS}")
+        if coordinates not in self.COORDINATES:
+            raise ValueError(f"Unknown coordinates {coordinates}, expected one of {self.COORDINATES}")
+        if backend == "least_squares" and coordinates != "quaternion":
+            raise ValueError("The least_squares backend only supports quaternion coordinates.")
+
+        self.sys = sys
+        self.tol = tol
+        self.maxIter = maxIter
+        self.reuse = reuse
+        self.contraction = contraction
+        self.maxHalvings = maxHalvings
+        self.backend = backend
+        self.tangent = coordinates == "rotationVector"
+
+        self._J = None
+        self._lu = None
+        self._perm = None
+        self._compiled = None
+        self._poses = None
+        self.stats = {"iterations": 0, "factorizations": 0, "solves": 0}
+
+    def factorize(self) -> None:
+        """
+        Evaluates the jacobian at the current state and factorizes J^T J, reusing the ordering
+        """
+        compiled = self.sys._compiled()
+        J = compiled.tangentJacobian(compiled.buffer) if self.tangent else self.sys.jacobian()
+        A = (J.T @ J).tocsc()
+
+        # The ordering only depends on the topology, recompute it only if the system was recompiled
+        if self._perm is None or self._compiled is not self.sys.compiled:
+            self._perm = reverse_cuthill_mckee(A, symmetric_mode=True)
+            self._iperm = np.argsort(self._perm)
+            self._compiled = self.sys.compiled
+
+        self._lu = splu(A[self._perm][:, self._perm], permc_spec="NATURAL")
+        self._J = J
+        self._poses = self.sys.poses().copy()
+        self.stats["factorizations"] += 1
+
+    def step(self, Phi: NDArray) -> NDArray:
+        """
+        Gauss-Newton step from the current factorization
+        """
+        g = self._J.T @ Phi
+        return -self._lu.solve(g[self._perm])[self._iperm]
+
+    def linearSolve(self, B: NDArray) -> NDArray:
+        """
+        Least squares solution X of J X = B at the current configuration, for one or many right hand sides
+        The factorization is reused if it was taken at the current poses (e.g. right after a solve
+        that ended on a fresh factorization), otherwise it is refreshed once
+        """
+        sys = self.sys
+        if (self._lu is None or self._compiled is not sys.compiled
+                or not np.array_equal(self._poses, sys.poses())):
+            self.factorize()
+        if not self.tangent:
+            g = self._J.T @ B
+            return self._lu.solve(g[self._perm])[self._iperm]
+
+        # Solve in the tangent space and map back to pose coordinates, dx = E(q) dt
+        compiled = sys.compiled
+        g = self._J.T @ B[:compiled.nConstraints]
+        dt = self._lu.solve(g[self._perm])[self._iperm]
+        E = compiled.tangentBasis(compiled.buffer)
+        dt = dt.reshape((compiled.nFree, 6) + dt.shape[1:])
+        return np.einsum("bij,bj...->bi...", E, dt).reshape((compiled.nState,) + dt.shape[2:])
+
+    def _residual(self) -> NDArray:
+        """
+        The residual the solver drives to zero, without the normalization rows in tangent coordinates
+        """
+        Phi = self.sys.residual()
+        return Phi[:self.sys.compiled.nConstraints] if self.tangent else Phi
+
+    def _move(self, x: NDArray, dx: NDArray) -> NDArray:
+        """
+        State x moved by the step dx
+        """
+        if not self.tangent:
+            return x + dx
+        compiled = self.sys.compiled
+        return compiled.retract(x.reshape(-1, 7), dx).ravel()
+
+    def solve(self, x0: NDArray | None = None) -> NDArray:
+        """
+        Solves the constraints starting from x0 (default: the current state)
+        The solution is left in the system state, a copy is returned
+        """
+        self.stats["solves"] += 1
+        if self.backend == "least_squares":
+            return self._leastSquares(x0)
+
+        sys = self.sys
+        if x0 is not None:
+            sys.unpack(x0)
+        state = sys.state
+        if self.tangent:
+            q = sys.poses()[:sys.compiled.nFree,3:]
+            q /= np.linalg.norm(q, axis=-1, keepdims=True)
+
+        Phi = self._residual()
+        norm = np.linalg.norm(Phi)
+        fresh = False
+        if self._lu is None or not self.reuse or self._compiled is not sys.compiled:
+            self.factorize()
+            fresh = True
+
+        for _ in range(self.maxIter):
+            if np.max(np.abs(Phi)) < self.tol:
+                return state.copy()
+
+            self.stats["iterations"] += 1
+            dx = self.step(Phi)
+            x = state.copy()
+
+            alpha = 1.0
+            for _ in range(self.maxHalvings):
+                state[:] = self._move(x, alpha * dx)
+                Phi_new = self._residual()
+                norm_new = np.linalg.norm(Phi_new)
+                if norm_new < norm:
+                    break
+                alpha /= 2
+            else:
+                state[:] = x
+                if fresh:
+                    raise RuntimeError("Newton step failed to reduce the residual.")
+                # A stale factorization gave a bad direction, refresh it and retry
+                self.factorize()
+                fresh = True
+                continue
+
+            ratio = norm_new / norm
+            Phi, norm = Phi_new, norm_new
+
+            fresh = False
+            if not self.reuse or ratio > self.contraction:
+                if np.max(np.abs(Phi)) >= self.tol:
+                    self.factorize()
+                    fresh = True
+
+        if np.max(np.abs(Phi)) < self.tol:
+            return state.copy()
+        raise RuntimeError(f"Newton solve did not converge in {self.maxIter} iterations.")
+
+    def _leastSquares(self, x0: NDArray | None) -> NDArray:
+        sys = self.sys
+        x0 = sys.pack() if x0 is None else x0
+
+        def residual_fun(x):
+            sys.unpack(x)
+            return(sys.residual())
+
+        def jacobian_fun(x):
+            sys.unpack(x)
+            self.stats["factorizations"] += 1
+            return(sys.jacobian())
+
+        sol = least_squares(residual_fun, x0, jac=jacobian_fun)
+        self.stats["iterations"] += sol.nfev
+        sys.unpack(sol.x)
+        return sol.x
+
+
+#%%
+# Drive inputs
+
+def motionPoses(motion, steps) -> NDArray:
+    """
+    Poses of a motion at every step, a MotionProfile is indexed directly and a heave_motion style
+    callable (step -> r, q) is evaluated per step
+    Returns the (N, 7) stack of [r, q] poses
+    """
+    if hasattr(motion, "posesAt"):
+        return motion.posesAt(steps)
+    return np.array([np.concatenate(motion(step)) for step in steps], dtype=float).reshape(-1, 7)
+
+
+def drivePoses(sys: MultibodySystem, steps) -> dict:
+    """
+    {body: (N, 7) poses} of every driven body over the steps, the whole input path of a sweep
+    """
+    compiled = sys._compiled()
+    steps = list(steps)
+    return {b: motionPoses(b.motion, steps) for b in compiled.bodies if b.motion is not None}
+
+
+def applyDrive(sys: MultibodySystem, drive: dict, k: int) -> None:
+    """
+    Moves the driven bodies to their k-th pose of drive (see drivePoses)
+    """
+    compiled = sys._compiled()
+    for body, poses in drive.items():
+        compiled.buffer[compiled.bodyIndex[body]] = poses[k]
+
+
+#%%
+# Batched solver
+
+def solveBatch(sys: MultibodySystem, drive: dict, x0: NDArray | None = None,
+               tol: float = 1e-10, maxIter: int = 20, chunkSize: int = 4096, frameLocal: NDArray | None = None,
+               coordinates: str = "quaternion") -> NDArray:
+    """
+    Solves N configurations of the system at once with a batched Gauss-Newton iteration.
+
+    :param sys: The multibody system
+    :param drive: {body: (N, 7) poses} for the prescribed bodies that change between configurations.
+                  Any other prescribed body keeps its current pose. May be empty if x0 is (N, nState)
+    :param x0: Initial guess, either one state (nState,) used for every configuration or (N, nState)
+               Defaults to the current state of the system
+    :param tol: Convergence tolerance on the largest residual
+    :param maxIter: Maximum number of Gauss-Newton iterations
+    :param chunkSize: Configurations solved together, bounds the size of the dense jacobian stack
+    :param frameLocal: Optional (N, n_frames, 3) frame table per configuration, e.g. perturbed hardpoints
+    :param coordinates: "quaternion" or "rotationVector", the step coordinates (see NewtonSolver)
+    :return: (N, nState) array of solved states
+    """
+    if coordinates not in NewtonSolver.COORDINATES:
+        raise ValueError(f"Unknown coordinates {coordinates}, expected one of {NewtonSolver.COORDINATES}")
+    compiled = sys._compiled()
+    n = compiled.nState
+
+    if drive:
+        N = len(next(iter(drive.values())))
+    elif x0 is not None and np.ndim(x0) == 2:
+        N = len(x0)
+    else:
+        raise ValueError("Without drive the configurations are counted from x0, which must then be (N, nState).")
+    poses = np.repeat(compiled.buffer[None], N, axis=0)
+    for body, p in drive.items():
+        if body.free:
+            raise RuntimeError(
+                f"Body {body.name} is free and cannot be driven."
+            )
+        poses[:,compiled.bodyIndex[body]] = p
+
+    X = np.empty((N, n))
+    X[:] = compiled.state if x0 is None else x0
+
+    for start in range(0, N, chunkSize):
+        chunk = slice(start, min(start + chunkSize, N))
+        s = None if frameLocal is None else frameLocal[chunk]
+        X[chunk], _ = _gaussNewton(compiled, poses[chunk], X[chunk], tol, maxIter, s,
+                                   tangent=coordinates == "rotationVector")
+
+    return X
+
+
+def _gaussNewton(compiled, poses: NDArray, X: NDArray, tol: float, maxIter: int,
+                 frameLocal: NDArray | None = None, tangent: bool = False) -> tuple:
+    """
+    Batched Gauss-Newton on a stack of configurations, optionally each with its own frame table
+    Only the configurations that have not converged yet are evaluated each iteration
+    With tangent=True the steps are taken in the rotation vector formulation, without the normalization rows
+    Returns the solved states and the number of iterations each configuration took
+    """
+    nFree = compiled.nFree
+    poses[:,:nFree] = X.reshape(len(X), nFree, 7)
+    m = compiled.nConstraints if tangent else compiled.nResiduals
+    if tangent:
+        poses[:,:nFree,3:] /= np.linalg.norm(poses[:,:nFree,3:], axis=-1, keepdims=True)
+    active = np.arange(len(X))
+    iterations = np.zeros(len(X), dtype=int)
+
+    def frames(index):
+        return None if frameLocal is None else frameLocal[index]
+
+    for _ in range(maxIter):
+        P = poses[active]
+        Phi = compiled.residual(P, frames(active))[...,:m]
+        converged = np.max(np.abs(Phi), axis=-1) < tol
+        active, P, Phi = active[~converged], P[~converged], Phi[~converged]
+        if len(active) == 0:
+            break
+
+        # Least squares step through a batched QR of the (possibly overdetermined) jacobian
+        J = compiled.denseTangentJacobian(P, frames(active)) if tangent else compiled.denseJacobian(P, frames(active))
+        Q, R = np.linalg.qr(J)
+        dx = np.linalg.solve(R, -np.einsum("...ji,...j->...i", Q, Phi)[...,None])[...,0]
+        if tangent:
+            poses[active,:nFree] = compiled.retract(P, dx)
+        else:
+            poses[active,:nFree] += dx.reshape(len(active), nFree, 7)
+        iterations[active] += 1
+    else:
+        Phi = compiled.residual(poses[active], frames(active))[...,:m]
+        if np.any(np.max(np.abs(Phi), axis=-1) >= tol):
+            raise RuntimeError(
+                f"Batched solve did not converge for {np.sum(np.max(np.abs(Phi), axis=-1) >= tol)} configurations."
+            )
+
+    return poses[:,:nFree].reshape(len(X), -1), iterations
+
+
+#%%
+# Continuation
+
+PREDICTORS = ("tangent", "secant", "quadratic")
+
+def motionDerivative(motion, step: float, h: float = 1e-6) -> NDArray:
+    """
+    d[r, q]/ds of a heave_motion style callable, by central differences
+    """
+    hi = np.concatenate(motion(step + h))
+    lo = np.concatenate(motion(step - h))
+    return (hi - lo) / (2 * h)
+
+
+def solutionTangent(sys: MultibodySystem, step: float) -> NDArray:
+    """
+    dx/ds of the solution path at the current configuration
+    Differentiating Phi(x, p(s)) = 0 gives J dx/ds = -J_p dp/ds, where J_p are the jacobian
+    columns of the driven bodies and dp/ds comes from their motion
+    """
+    compiled = sys._compiled()
+    J = compiled.denseJacobian(compiled.buffer, full=True)
+
+    rhs = np.zeros(compiled.nResiduals)
+    for body in compiled.bodies[compiled.nFree:]:
+        if body.motion is None:
+            continue
+        b = compiled.bodyIndex[body]
+        rhs -= J[:, 7*b:7*b + 7] @ motionDerivative(body.motion, step)
+
+    return np.linalg.lstsq(J[:, :compiled.nState], rhs, rcond=None)[0]
+
+
+def continuationSweep(sys: MultibodySystem, steps, predictor: str = "tangent",
+                      tol: float = 1e-10, maxIter: int = 20, compare: bool = False) -> tuple:
+    """
+    Predictor-corrector sweep along the driven bodies' motions.
+    Instead of seeding each step with the previous solution, the initial guess is extrapolated along
+    the solution path, so the Gauss-Newton corrector starts close to the solution on the same branch.
+
+    :param steps: Motion steps, passed to every driven body's motion like kinematicsSim does
+    :param predictor: "tangent" uses dx/ds from the constraint jacobian, "secant" extrapolates the last
+                      two solutions and "quadratic" the last three. Missing history falls back to tangent
+    :param compare: Also solve every step from the previous solution to count the corrector iterations saved
+    :return: (hist, stats), hist is the Trajectory of the poses starting with the initial state,
+             stats holds the corrector iterations per step and, with compare, the iterations saved
+    """
+    if predictor not in PREDICTORS:
+        raise ValueError(f"Unknown predictor {predictor}, expected one of {PREDICTORS}")
+
+    compiled = sys._compiled()
+    steps = list(steps)
+    drive = drivePoses(sys, steps)
+
+    hist = Trajectory(sys, capacity=len(steps) + 1)
+    hist.record()
+    X = np.empty((len(steps) + 1, compiled.nState))
+    X[0] = sys.pack()
+    iterations = np.zeros(len(steps), dtype=int)
+    baseline = np.zeros(len(steps), dtype=int) if compare else None
+
+    s = []  # motion parameter of every solved point, for the extrapolating predictors
+    x = X[0]
+    for k, step in enumerate(steps):
+        if k == 0:
+            x_pred = x
+        elif predictor == "quadratic" and k >= 3:
+            x_pred = _extrapolate(s[-3:], X[k-2:k+1], step)
+        elif predictor == "secant" and k >= 2 or predictor == "quadratic" and k == 2:
+            x_pred = _extrapolate(s[-2:], X[k-1:k+1], step)
+        else:
+            x_pred = x + solutionTangent(sys, s[-1]) * (step - s[-1])
+
+        applyDrive(sys, drive, k)
+
+        if compare:
+            _, its = _gaussNewton(compiled, compiled.buffer[None].copy(), x[None], tol, maxIter)
+            baseline[k] = its[0]
+
+        solution, its = _gaussNewton(compiled, compiled.buffer[None].copy(), x_pred[None], tol, maxIter)
+        x = solution[0]
+        sys.unpack(x)
+        X[k+1] = x
+        hist.record()
+        iterations[k] = its[0]
+        s.append(step)
+    hist.flush()
+
+    stats = {
+        "iterations": iterations,
+        "baseline": baseline,
+        "saved": None if baseline is None else int(np.sum(baseline - iterations)),
+    }
+    return hist, stats
+
+
+def _extrapolate(s: list, X: NDArray, step: float) -> NDArray:
+    """
+    Lagrange extrapolation of the solutions X at parameters s to the parameter step
+    """
+    x = np.zeros(X.shape[1])
+    for i, si in enumerate(s):
+        w = np.prod([(step - sj) / (si - sj) for j, sj in enumerate(s) if j != i])
+        x += w * X[i]
+    return x
+
+
+#%%
+# Adaptive sweep
+
+def adaptiveSweep(sys: MultibodySystem, outputSteps, initialStep: float | None = None,
+                  minStep: float | None = None, maxStep: float | None = None, predictorTol: float = 1e-3,
+                  tol: float = 1e-10, maxIter: int = 8, polish: bool = False, output=None) -> tuple:
+    """
+    Sweep with adaptive step size along the driven bodies' motions, resampled onto outputSteps.
+
+    Each step is predicted along the solution tangent and corrected with Gauss-Newton. The difference
+    between the predicted and corrected outputs measures how curved the path is (it grows with step^2),
+    so the step grows where the outputs are nearly linear and shrinks where they bend.
+    Steps whose corrector fails or needs many iterations, or whose prediction is far off,
+    are rejected and retried smaller, which keeps the sweep on the assembled branch.
+
+    :param outputSteps: Increasing motion parameters to report the solution at. The system is assumed
+                        to be assembled at (or near) the first one
+    :param initialStep, minStep, maxStep: Step size limits, default to fractions of the output range
+    :param predictorTol: Target predictor error on the outputs
+    :param polish: Also run one batched solve from the interpolated states so the output is exact. That solves
+                   every output point, so it only pays off when the spline error (about predictorTol^2) matters
+    :param output: output(compiled, poses) -> array watched for curvature, defaults to every frame's global position
+    :return: (hist, stats), hist is the Trajectory of the poses at outputSteps, with the driven bodies at
+             their motion, stats holds the accepted motion parameters, the number of solves (including the
+             polished points), accepted and rejected steps and polished points
+    """
+    outputSteps = np.asarray(list(outputSteps), dtype=float)
+    if len(outputSteps) == 0:
+        raise ValueError("outputSteps is empty")
+    if np.any(np.diff(outputSteps) <= 0):
+        raise ValueError("outputSteps must be increasing")
+
+    compiled = sys._compiled()
+    driven = [b for b in compiled.bodies if b.motion is not None]
+    output = output or (lambda compiled, poses: compiled.framePositions(poses))
+
+    span = outputSteps[-1] - outputSteps[0]
+    minStep = minStep or span * 1e-6
+    maxStep = maxStep or span / 4
+    h = initialStep or max(np.min(np.diff(outputSteps), initial=span), minStep)
+
+    def solveAt(step, x_guess):
+        for body in driven:
+            body.r, body.q = body.motion(step)
+        X, its = _gaussNewton(compiled, compiled.buffer[None].copy(), x_guess[None], tol, maxIter)
+        sys.unpack(X[0])
+        return X[0], its[0]
+
+    x, _ = solveAt(outputSteps[0], sys.pack())
+    s_hist, x_hist = [outputSteps[0]], [x]
+    solves, rejected = 1, 0
+
+    while s_hist[-1] < outputSteps[-1]:
+        s = s_hist[-1]
+        h = min(h, outputSteps[-1] - s)
+
+        x_pred = x + solutionTangent(sys, s) * h
+        out_pred = output(compiled, _withState(compiled, x_pred, driven, s + h))
+
+        try:
+            solves += 1
+            x_new, its = solveAt(s + h, x_pred)
+            err = np.max(np.abs(output(compiled, compiled.buffer) - out_pred))
+        except (RuntimeError, np.linalg.LinAlgError):
+            its, err = maxIter, np.inf
+
+        if err > 4 * predictorTol or its >= maxIter - 2:
+            # Reject, go back to the last accepted point with a smaller step
+            rejected += 1
+            sys.unpack(x)
+            for body in driven:
+                body.r, body.q = body.motion(s)
+            h *= 0.25 if not np.isfinite(err) else max(0.25, 0.9 * np.sqrt(predictorTol / err))
+            if h < minStep:
+                raise RuntimeError(f"Adaptive sweep step fell below {minStep} at step {s}.")
+            continue
+
+        x = x_new
+        s_hist.append(s + h)
+        x_hist.append(x)
+
+        # Predictor error is second order in the step
+        factor = 2.0 if err == 0 else np.clip(0.9 * np.sqrt(predictorTol / err), 0.5, 2.0)
+        if its > 3:
+            factor = min(factor, 1.0)
+        h = np.clip(h * factor, minStep, maxStep)
+
+    s_hist = np.array(s_hist)
+    if len(s_hist) > 1:
+        states = CubicSpline(s_hist, np.array(x_hist), axis=0)(outputSteps)
+    else:
+        # A single output point is just the first solve
+        states = np.array(x_hist)
+
+    drive = {body: motionPoses(body.motion, outputSteps) for body in driven}
+    if polish:
+        states = solveBatch(sys, drive, states, tol=tol)
+        solves += len(outputSteps)
+
+    poses = np.repeat(compiled.buffer[None], len(outputSteps), axis=0)
+    for body, p in drive.items():
+        poses[:,compiled.bodyIndex[body]] = p
+    poses[:,:compiled.nFree] = states.reshape(len(outputSteps), compiled.nFree, 7)
+    hist = Trajectory(sys, capacity=len(poses))
+    hist.extend(poses)
+
+    stats = {
+        "steps": s_hist,
+        "solves": solves,
+        "accepted": len(s_hist) - 1,
+        "rejected": rejected,
+        "polished": len(outputSteps) if polish else 0,
+    }
+    return hist, stats
+
+
+def _withState(compiled, x: NDArray, driven: list, step: float) -> NDArray:
+    """
+    Copy of the pose buffer with the state x and the driven bodies at step
+    """
+    poses = compiled.buffer.copy()
+    poses[:compiled.nFree] = x.reshape(-1, 7)
+    for body in driven:
+        poses[compiled.bodyIndex[body]] = np.concatenate(body.motion(step))
+    return poses
@@ -1,5 +1,154 @@
 import pandas as pd
+import numpy as np
+from components import MultibodySystem, Body, Tire, Frame, SphericalJoint, CartesianJoint, DistanceJoint, GroundContact
+from kinematicsSim import heave_motion
 
 
+# Coordinate index of a hardpoint axis name
+AXES = {"x": 0, "y": 1, "z": 2}
 
-def buildDoubleWishbone(file:
\ No newline at end of file
+
+def readParams(file: str) -> tuple:
+    """
+    Reads a suspension parameter file like doubleWishboneParams.csv
+    The hardpoints are the named X,Y,Z rows, the scalar parameters are the name/value pairs beside them
+
+    :return: (hardpoints, params), {name: array([x,y,z])} and {name: value}
+    """
+    df = pd.read_csv(file, index_col=0)
+
+    hardpoints = {
+        name: row.to_numpy(dtype=float)
+        for name, row in df[["X", "Y", "Z"]].dropna().iterrows()
+    }
+
+    scalars = df.iloc[:, -2:].dropna()
+    params = dict(zip(scalars.iloc[:, 0], scalars.iloc[:, 1].astype(float)))
+
+    return hardpoints, params
+
+
+def wheelAxis(params: dict, side: int = 1) -> np.ndarray:
+    """
+    Unit spin axis of the wheel, pointing outboard, from the static camber and toe (degrees)
+    Negative camber (top of the wheel inboard) tips the outboard end up, toe in turns it forward (+x)
+    side=-1 gives the axis of a mirrored (right hand) corner, outboard along -y
+    """
+    camber = np.radians(params.get("staticCamber", 0))
+    toe = np.radians(params.get("staticToe", 0))
+    return np.array([np.sin(toe) * np.cos(camber),
+                     side * np.cos(toe) * np.cos(camber),
+                     -np.sin(camber)])
+
+
+def mirrorHardpoints(hardpoints: dict) -> dict:
+    """
+    Hardpoints of the opposite side, mirrored about the vehicle centerline (y -> -y)
+    """
+    return {name: np.asarray(p, dtype=float) * [1, -1, 1] for name, p in hardpoints.items()}
+
+
+def buildDoubleWishbone(file: str = "doubleWishboneParams.csv", hardpoints: dict | None = None,
+                        params: dict | None = None, tire: bool = False, rack: bool = False) -> MultibodySystem:
+    """
+    Builds a double wishbone corner from a parameter file, or from hardpoints / params directly
+    (e.g. a perturbed copy of the file's hardpoints)
+
+    Every body sits at the origin with its frames at the hardpoint coordinates, so frames that share
+    a hardpoint start coincident. Frames keep the hardpoint name.
+    The chassis is driven by heave_motion and the wheel center is held at its height above the ground,
+    the tie rod is a fixed length link between the chassis and the upright.
+    With tire=True the upright is a Tire (tireDiam, rimDiam, tireWidth) and its lowest point is held
+    on the ground instead of the wheel center height.
+    With rack=True the tie rod's inner point sits on a driven "rack" body instead of the chassis. It follows
+    heave_motion like the chassis until both are given profiles, e.g. rackMotion(travel, chassis=profile)
+    """
+    if hardpoints is None or params is None:
+        fileHardpoints, fileParams = readParams(file)
+        hardpoints = fileHardpoints if hardpoints is None else hardpoints
+        params = fileParams if params is None else params
+
+    # Define the bodies
+    world = Body("world", [0,0,0], [1,0,0,0], free=False)
+
+    chassis = Body("chassis", [0,0,0], [1,0,0,0], free=False)
+    chassis.setMotion(heave_motion)
+
+    bodies = [world, chassis]
+    steering = None
+    if rack:
+        steering = Body("rack", [0,0,0], [1,0,0,0], free=False)
+        steering.setMotion(heave_motion)
+        bodies.append(steering)
+
+    sys = MultibodySystem()
+    sys.addBody(bodies)
+    addCorner(sys, world, chassis, hardpoints, params, tire=tire, rack=steering)
+
+    return sys
+
+
+def addCorner(sys: MultibodySystem, world: Body, chassis: Body, hardpoints: dict, params: dict, prefix: str = "",
+              side: int = 1, tire: bool = False, rack: Body | None = None) -> dict:
+    """
+    Adds a double wishbone corner between the world and chassis bodies of sys (see buildDoubleWishbone)
+    Bodies and frames are named prefix + name, e.g. "FL.upright" and "FL.chasLowFor"
+
+    :param hardpoints: The corner's hardpoints in vehicle coordinates, e.g. mirrorHardpoints for a right corner
+    :param side: 1 for a left corner (outboard along +y), -1 for a right one
+    :param rack: Optional body that carries the tie rod's inner point instead of the chassis
+    :return: {"LCA", "UCA", "upright"} bodies of the corner
+    """
+    def frame(name):
+        return Frame(hardpoints[name], designVariable=True, name=prefix + name)
+
+    chassis_frames = {name: frame(name) for name in
+                      ["chasLowFor", "chasLowAft", "chasUppFor", "chasUppAft", "chasTiePnt", "chasCoil"]}
+    chassis.addFrame([f for name, f in chassis_frames.items() if not (rack and name == "chasTiePnt")])
+    if rack:
+        rack.addFrame([chassis_frames["chasTiePnt"]])
+
+    LCA = Body(prefix + "LCA", [0,0,0], [1,0,0,0], free=True)
+    LCA_frames = {name: frame(name) for name in ["chasLowFor", "chasLowAft", "upriLowPnt"]}
+    LCA.addFrame(list(LCA_frames.values()))
+
+    UCA = Body(prefix + "UCA", [0,0,0], [1,0,0,0], free=True)
+    UCA_frames = {name: frame(name) for name in ["chasUppFor", "chasUppAft", "upriUppPnt", "ucaCoil"]}
+    UCA.addFrame(list(UCA_frames.values()))
+
+    axis = wheelAxis(params, side)
+    upright_frames = {name: frame(name) for name in ["upriLowPnt", "upriUppPnt", "upriTiePnt", "wheelCenter"]}
+    if tire:
+        upright = Tire(prefix + "upright", [0,0,0], [1,0,0,0], params["tireDiam"], params["rimDiam"],
+                       params["tireWidth"], center=upright_frames["wheelCenter"], axis=axis, free=True)
+    else:
+        upright = Body(prefix + "upright", [0,0,0], [1,0,0,0], free=True)
+    upright_frames["wheelAxis"] = Frame(hardpoints["wheelCenter"] + axis, name=prefix + "wheelAxis")
+    upright.addFrame([f for f in upright_frames.values() if f.body is None])
+
+    # Hold the wheel on the ground, through the tire contact point or the wheel center height
+    if tire:
+        ground = Frame(upright.contactPoint(), name=prefix + "ground")
+        world.addFrame([ground])
+        wheelConstraint = GroundContact(upright, ground)
+    else:
+        world_wheelCenter = frame("wheelCenter")
+        world.addFrame([world_wheelCenter])
+        wheelConstraint = CartesianJoint(upright_frames["wheelCenter"], world_wheelCenter, fixedAxis=[0,0,1])
+
+    # Define the joints that link the bodies together
+    joints = [
+        SphericalJoint(chassis_frames["chasLowFor"], LCA_frames["chasLowFor"]),
+        SphericalJoint(chassis_frames["chasLowAft"], LCA_frames["chasLowAft"]),
+        SphericalJoint(chassis_frames["chasUppFor"], UCA_frames["chasUppFor"]),
+        SphericalJoint(chassis_frames["chasUppAft"], UCA_frames["chasUppAft"]),
+        SphericalJoint(LCA_frames["upriLowPnt"], upright_frames["upriLowPnt"]),
+        SphericalJoint(UCA_frames["upriUppPnt"], upright_frames["upriUppPnt"]),
+        DistanceJoint(chassis_frames["chasTiePnt"], upright_frames["upriTiePnt"]),
+        wheelConstraint,
+    ]
+
+    sys.addBody([LCA, UCA, upright])
+    sys.addJoint(joints)
+
+    return {"LCA": LCA, "UCA": UCA, "upright": upright}
@@ -0,0 +1,26 @@
+import numpy as np
+from suspension_util import buildDoubleWishbone
+from kinematicsSim import kinematicsSim
+from clearance import Clearance, suspensionParts
+
+
+def test_check_matches_brute_force_where_parts_interfere():
+    sys = buildDoubleWishbone(tire=True, rack=True)
+    upright = sys.getBody("upright")
+    upright.attachPoints("cloud", upright.pointCloud(100))
+    history = kinematicsSim(sys, 20)
+
+    clearance = Clearance(sys, suspensionParts(sys))
+    result = clearance.check(history)
+
+    # Every pair's exact distance at every step, no culling
+    poses = np.asarray(sys.historyPoses(history), dtype=float)
+    local = clearance._localGeometry(sys.compiled, poses)
+    brute = np.array([[clearance._distance(pair, local, k, np.inf) for pair in clearance.pairs]
+                      for k in range(len(poses))])
+
+    assert np.min(brute) < 0
+    assert np.allclose(result["clearance"], brute.min(axis=1))
+    assert np.array_equal(result["pair"], brute.argmin(axis=1))
+    step = int(np.argmin(brute.min(axis=1)))
+    assert result["worst"][:2] == (step, clearance.pairs[brute[step].argmin()])
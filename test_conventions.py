@@ -0,0 +1,50 @@
+import os
+import numpy as np
+from suspension_util import buildDoubleWishbone, readParams, wheelAxis
+from metrics import SuspensionMetrics
+from vehicle import buildVehicle, cornerMetrics, gridSweep
+from kinematicsSim import kinematicsSim
+
+
+PARAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "doubleWishboneParams.csv")
+
+
+def test_wheel_axis_negative_camber_tips_outboard_end_up():
+    # Top of the wheel inboard: the spin axis rises going outboard, on either side
+    for side in (1, -1):
+        axis = wheelAxis({"staticCamber": -5.0}, side)
+        assert side * axis[1] > 0
+        assert axis[2] > 0
+
+
+def test_static_camber_reads_back_from_the_built_geometry():
+    _, params = readParams(PARAMS)
+    sys = buildDoubleWishbone(PARAMS, tire=True)
+    sys.solve()
+
+    # Independent of the metric: the contact patch of a negative camber wheel is outboard of its center
+    upright = sys.getBody("upright")
+    center = sys.getFrame("wheelCenter", "upright").globalPosition()
+    assert np.sign(params["staticCamber"]) * (upright.contactPoint()[1] - center[1]) < 0
+
+    camber = SuspensionMetrics.fromParams(sys, params).compute(sys.poses()[None])["camber"]
+    assert np.isclose(camber[0], params["staticCamber"])
+
+
+def test_left_and_right_corners_agree():
+    _, params = readParams(PARAMS)
+    car = buildVehicle(PARAMS)
+    traj, _ = gridSweep(car, np.linspace(-1, 1, 5))
+    left = cornerMetrics(car, params, "FL").compute(traj)
+    right = cornerMetrics(car, params, "FR").compute(traj)
+    for name in ("camber", "toe", "camberGain", "kpi", "scrubRadius"):
+        assert np.allclose(left[name], right[name])
+    assert np.isclose(left["camber"][2], params["staticCamber"])
+
+
+def test_gains_are_finite_on_the_default_sweep():
+    _, params = readParams(PARAMS)
+    sys = buildDoubleWishbone(PARAMS)
+    metrics = SuspensionMetrics.fromParams(sys, params).compute(kinematicsSim(sys, 20))
+    for name in ("motionRatio", "camberGain", "toeGain"):
+        assert np.all(np.isfinite(metrics[name]))
@@ -0,0 +1,89 @@
+import numpy as np
+from components import (MultibodySystem, Body, Tire, Frame, SphericalJoint, RevoluteJoint, CartesianJoint,
+                        DistanceJoint, GroundContact)
+
+
+H = 1e-6
+
+
+def _system(seed=0):
+    """
+    Two free bodies on a fixed ground with a joint of every type, at a random unit quaternion pose
+    """
+    rng = np.random.default_rng(seed)
+    ground = Body("ground", [0,0,0], [1,0,0,0])
+    arm = Body("arm", [0,0,0], [1,0,0,0], free=True)
+    tire = Tire("tire", [0,0,0], [1,0,0,0], 24.0, 13.0, 8.0, center=[1,2,3], axis=[0,1,0], free=True)
+
+    frames = {b: [Frame(rng.normal(size=3) * 5) for _ in range(5)] for b in (ground, arm, tire)}
+    for body, f in frames.items():
+        body.addFrame(f)
+    g, a, t = frames[ground], frames[arm], frames[tire]
+
+    sys = MultibodySystem()
+    sys.addBody([ground, arm, tire])
+    sys.addJoint([
+        SphericalJoint(g[0], a[0]),
+        RevoluteJoint(a[1], t[1], AoR=[1,2,3]),
+        CartesianJoint(g[2], a[2], fixedAxis=[0.6,0,0.8]),
+        DistanceJoint(a[3], t[3]),
+        DistanceJoint(g[4], t[4], length=7.0),
+        GroundContact(tire, g[1]),
+    ])
+
+    compiled = sys._compiled()
+    q = rng.normal(size=(len(compiled.bodies), 4))
+    compiled.buffer[:] = np.concatenate([rng.normal(size=(len(q), 3)) * 5, q / np.linalg.norm(q, axis=-1)[:,None]],
+                                        axis=-1)
+    return sys, compiled
+
+
+def _difference(f, x):
+    """
+    Central differences of f at x along every coordinate of x, (*f.shape, *x.shape)
+    """
+    x = np.asarray(x, dtype=float)
+    columns = []
+    for i in range(x.size):
+        dx = np.zeros(x.size)
+        dx[i] = H
+        dx = dx.reshape(x.shape)
+        columns.append((f(x + dx) - f(x - dx)) / (2 * H))
+    return np.stack(columns, axis=-1)
+
+
+def test_compiled_jacobian_matches_finite_differences():
+    sys, compiled = _system()
+    poses = compiled.buffer.copy()
+
+    J = _difference(lambda p: compiled.residual(p), poses)
+    assert np.allclose(compiled.denseJacobian(poses, full=True), J, atol=1e-6)
+    assert np.allclose(compiled.jacobian(poses, full=True).toarray(), J, atol=1e-6)
+
+
+def test_offset_jacobian_matches_finite_differences():
+    sys, compiled = _system()
+    poses = compiled.buffer.copy()
+
+    D = _difference(lambda s: compiled.residual(poses, s), compiled.frameLocal)
+    assert np.allclose(compiled.offsetJacobian(poses), D, atol=1e-6)
+
+
+def test_tangent_jacobian_matches_finite_differences():
+    sys, compiled = _system()
+    poses = compiled.buffer.copy()
+
+    def moved(dx):
+        P = poses.copy()
+        P[:compiled.nFree] = compiled.retract(poses, dx)
+        return compiled.residual(P)[:compiled.nConstraints]
+
+    J = _difference(moved, np.zeros(compiled.nTangent))
+    assert np.allclose(compiled.denseTangentJacobian(poses), J, atol=1e-6)
+    assert np.allclose(compiled.tangentJacobian(poses).toarray(), J, atol=1e-6)
+
+
+def test_joint_residuals_match_the_compiled_residual():
+    sys, compiled = _system()
+    scalar = [j.residual() for j in sys.joints] + [[b.residual()] for b in compiled.bodies[:compiled.nFree]]
+    assert np.allclose(np.concatenate(scalar), sys.residual())
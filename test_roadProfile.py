@@ -0,0 +1,15 @@
+import numpy as np
+from suspension_util import buildDoubleWishbone
+from roadProfile import RoadProfileDriver
+
+
+def test_reports_describe_their_own_chunk():
+    sys = buildDoubleWishbone()
+    driver = RoadProfileDriver(sys, chunkSize=50)
+    reports = list(driver.stream(np.sin(np.linspace(0, 3, 150))[:,None]))
+
+    assert [r["stop"] for r in reports] == [50, 100, 150]
+    for r in reports:
+        assert r["samples"] == r["stop"]
+        assert np.isclose(r["rate"], r["samples"] / r["elapsed"])
+    assert all(a["elapsed"] < b["elapsed"] for a, b in zip(reports, reports[1:]))
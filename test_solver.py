@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+from suspension_util import buildDoubleWishbone
+from solver import solveBatch
+
+
+def test_solve_batch_without_drive_counts_configurations_from_x0():
+    sys = buildDoubleWishbone()
+    sys.solve()
+    X = solveBatch(sys, {}, np.tile(sys.pack(), (3, 1)) + 1e-3)
+    assert X.shape == (3, sys.state.size)
+    assert np.allclose(X, sys.pack())
+
+    with pytest.raises(ValueError):
+        solveBatch(sys, {})
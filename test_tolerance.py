@@ -0,0 +1,22 @@
+import os
+import numpy as np
+from suspension_util import buildDoubleWishbone, readParams
+from metrics import SuspensionMetrics
+from tolerance import ToleranceAnalysis
+
+
+PARAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "doubleWishboneParams.csv")
+
+
+def test_failed_lists_only_the_samples_that_do_not_assemble():
+    _, params = readParams(PARAMS)
+    sys = buildDoubleWishbone(PARAMS)
+    sys.solve()
+
+    # Tolerances wide enough that some tail samples cannot assemble, all tail samples in one batch
+    analysis = ToleranceAnalysis(sys, SuspensionMetrics.fromParams(sys, params), 4.0, steps=range(10))
+    result = analysis.run(200, seed=1, tail=0.25, batchSize=220)
+
+    failed = set(result["failed"])
+    assert 0 < len(failed) < len(result["tail"])
+    assert failed <= set(result["tail"])
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+import pytest
+from suspension_util import buildDoubleWishbone, readParams
+from kinematicsSim import kinematicsSim
+from metrics import SuspensionMetrics
+from solver import continuationSweep
+from trajectory import Trajectory
+
+
+PARAMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "doubleWishboneParams.csv")
+
+
+def test_state_history_with_drive_matches_its_trajectory():
+    sys = buildDoubleWishbone()
+    traj = kinematicsSim(sys, 10)
+    compiled = sys.compiled
+
+    states = traj.poses[:, :compiled.nFree].reshape(len(traj), -1)
+    drive = {b: traj.poses[:, compiled.bodyIndex[b]] for b in sys.bodies if b.motion is not None}
+    assert np.allclose(sys.framePositions(states, drive=drive), traj.framePositions())
+
+    with pytest.raises(ValueError):
+        sys.framePositions(states)
+
+
+def test_continuation_sweep_returns_a_pose_trajectory():
+    _, params = readParams(PARAMS)
+    reference = kinematicsSim(buildDoubleWishbone(PARAMS), 10)
+    sys = buildDoubleWishbone(PARAMS)
+    hist, _ = continuationSweep(sys, range(10))
+    assert np.allclose(hist.framePositions(), reference.framePositions(), atol=1e-8)
+
+    metrics = SuspensionMetrics.fromParams(sys, params)
+    assert np.allclose(metrics.compute(hist)["camber"], metrics.compute(reference)["camber"], atol=1e-8)
+
+
+def test_flushed_empty_store_loads_empty_and_grows(tmp_path):
+    sys = buildDoubleWishbone(PARAMS)
+    path = str(tmp_path / "trajectory.npy")
+    traj = Trajectory(sys, capacity=8, path=path)
+    traj.flush()
+    assert np.load(path).shape == (0, traj.width)
+
+    traj.record()
+    traj.flush()
+    assert np.allclose(np.load(path), sys.poses().reshape(1, -1))
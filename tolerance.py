@@ -0,0 +1,145 @@
+import numpy as np
+from numpy.typing import NDArray
+from components import MultibodySystem
+from sensitivity import Sensitivity
+from solver import solveBatch
+
+
+DISTRIBUTIONS = ("normal", "uniform")
+
+
+#%%
+# Tolerance Analysis Class
+
+class ToleranceAnalysis:
+    """
+    Monte Carlo tolerance stack-up of the kinematic curves over a sweep.
+
+    Every sample perturbs all hardpoints within their tolerance. The outputs of all samples are first
+    predicted linearly from the nominal sweep's sensitivities, which costs one matrix product.
+    The samples whose prediction is furthest out (the tail fraction) decide the outer percentiles, so
+    only those are re-solved exactly, in batches of configurations that each carry their own frame table,
+    starting from their linear prediction.
+
+    :param metrics: SuspensionMetrics of sys
+    :param tolerances: Tolerance of every hardpoint coordinate, a value or {hardpoint: value or [x, y, z]},
+                       hardpoints that are not listed are exact
+    :param steps: Steps of the sweep, passed to the driven bodies' motions
+    :param distribution: "normal" (the tolerance is 3 sigma) or "uniform" (within +-tolerance)
+    :param outputs: Metrics to report
+    """
+
+    def __init__(self, sys: MultibodySystem, metrics, tolerances, steps=range(20), distribution: str = "normal",
+                 outputs: tuple = ("camber", "toe")) -> None:
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown distribution {distribution}, expected one of {DISTRIBUTIONS}")
+
+        self.sys = sys
+        self.metrics = metrics
+        self.steps = list(steps)
+        self.distribution = distribution
+        self.outputs = outputs
+        self.sensitivity = Sensitivity(sys)
+
+        names = self.sensitivity.names
+        if isinstance(tolerances, dict):
+            self.tolerance = np.zeros(3 * len(names))
+            for name, tol in tolerances.items():
+                i = names.index(name)
+                self.tolerance[3*i:3*i + 3] = tol
+        else:
+            self.tolerance = np.full(3 * len(names), float(tolerances))
+
+    def sample(self, n: int, seed: int | None = None) -> NDArray:
+        """
+        (n, n_parameters) hardpoint perturbations
+        """
+        rng = np.random.default_rng(seed)
+        if self.distribution == "normal":
+            return rng.standard_normal((n, len(self.tolerance))) * self.tolerance / 3
+        return rng.uniform(-1, 1, (n, len(self.tolerance))) * self.tolerance
+
+    def run(self, nSamples: int = 10000, seed: int | None = None, tail: float = 0.05,
+            percentiles=(1, 5, 50, 95, 99), batchSize: int = 4096) -> dict:
+        """
+        Runs the analysis from the system's current (assembled) configuration
+
+        :param tail: Fraction of the samples that is re-solved exactly
+        :param batchSize: Configurations (samples x sweep points) per batched solve
+        :return: {"percentiles": q, "nominal": {metric: (n_points,)},
+                  "linear": {metric: (len(q), n_points)} from the linear prediction of every sample,
+                  "corrected": {metric: (len(q), n_points)} with the tail samples re-solved,
+                  "values": {metric: (n_samples, n_points)} per sample, exact for the tail and linear otherwise,
+                  "samples": the perturbations, "tail": indices of the re-solved samples,
+                  "failed": indices of tail samples that did not assemble (their linear prediction is kept)}
+        """
+        sys = self.sys
+        compiled = sys._compiled()
+        S = self.sensitivity
+
+        history, dX = S.sweep(self.steps)
+        poses = np.array(history.poses)
+        nominal = self.metrics.compute(poses)
+        slopes = S.metricSensitivity(self.metrics, poses, dX)
+
+        # Linear prediction of every sample
+        dp = self.sample(nSamples, seed)
+        values = {name: nominal[name] + dp @ slopes[name].T for name in self.outputs}
+
+        # The tail are the samples with the largest standardized deviation at any point of any output
+        score = np.zeros(nSamples)
+        for name in self.outputs:
+            v = values[name]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                z = np.abs(v - np.nanmean(v, axis=0)) / np.nanstd(v, axis=0)
+            score = np.maximum(score, np.nanmax(np.nan_to_num(z, nan=0.0), axis=1))
+        nTail = int(np.ceil(tail * nSamples))
+        tailIndex = np.argsort(score)[::-1][:nTail]
+
+        linear = {name: np.nanpercentile(values[name], percentiles, axis=0) for name in self.outputs}
+
+        # Exact re-solve of the tail, every sample at every point of the sweep
+        nPoints = len(poses)
+        prescribed = [b for b in compiled.bodies if not b.free]
+        failed = []
+
+        def solve(batch):
+            frameLocal = compiled.frameLocal + (dp[batch] @ S.G.T).reshape(len(batch), -1, 3)
+            guess = poses[None,:,:compiled.nFree].reshape(1, nPoints, -1) + np.einsum("kij,nj->nki", dX, dp[batch])
+            drive = {b: np.tile(poses[:,compiled.bodyIndex[b]], (len(batch), 1)) for b in prescribed}
+            X = solveBatch(sys, drive, guess.reshape(-1, compiled.nState), chunkSize=batchSize,
+                           frameLocal=np.repeat(frameLocal, nPoints, axis=0))
+            return batch, frameLocal, X.reshape(len(batch), nPoints, compiled.nFree, 7)
+
+        perBatch = max(1, batchSize // nPoints)
+        for start in range(0, nTail, perBatch):
+            batch = tailIndex[start:start + perBatch]
+            try:
+                solved = [solve(batch)]
+            except (RuntimeError, np.linalg.LinAlgError):
+                # A single sample that does not assemble fails its whole batch, so they are retried one by one
+                solved = []
+                for sample in batch:
+                    try:
+                        solved.append(solve(np.array([sample])))
+                    except (RuntimeError, np.linalg.LinAlgError):
+                        failed.append(sample)
+
+            for batch, frameLocal, X in solved:
+                for i, sample in enumerate(batch):
+                    P = poses.copy()
+                    P[:,:compiled.nFree] = X[i]
+                    exact = self.metrics.compute(P, frameLocal[i])
+                    for name in self.outputs:
+                        values[name][sample] = exact[name]
+
+        return {
+            "percentiles": np.asarray(percentiles),
+            "nominal": {name: nominal[name] for name in self.outputs},
+            "linear": linear,
+            "corrected": {name: np.nanpercentile(values[name], percentiles, axis=0) for name in self.outputs},
+            "values": values,
+            "samples": dp,
+            "tail": tailIndex,
+            "failed": np.array(failed, dtype=int),
+        }
@@ -0,0 +1,230 @@
+import os
+import numpy as np
+from numpy.typing import NDArray
+from numpy.lib import format as npformat
+from components import MultibodySystem
+
+
+#%%
+# Trajectory Class
+
+class Trajectory:
+    """
+    Preallocated, growable store of the solved poses of a system.
+
+    Every row is a copy of the system's pose buffer (every body's [r, q], free bodies first),
+    so recording a step is a single copy and the packed state is the first nState entries of the row.
+    Named columns ("UCA", "UCA.r", "UCA.q", "chassis.r", ...) and the states / poses properties
+    are views into the store, not copies.
+
+    As a sequence it behaves like the old list of state vectors: len, iteration, integer indexing
+    and np.asarray all work on the states.
+
+    With a path the store is a .npy file opened as a memmap. It grows by extending the file and
+    rewriting the header in place, so the file is a valid .npy of the recorded rows once flushed.
+    """
+
+    def __init__(self, sys: MultibodySystem, capacity: int = 1024, path: str | None = None) -> None:
+        compiled = sys._compiled()
+        self.sys = sys
+        self.nState = compiled.nState
+        self.nBodies = len(compiled.bodies)
+        self.width = 7 * self.nBodies
+        self.path = path
+        self.length = 0
+
+        self.columns = {}
+        for i, body in enumerate(compiled.bodies):
+            self.columns[body.name] = slice(7*i, 7*i + 7)
+            self.columns[f"{body.name}.r"] = slice(7*i, 7*i + 3)
+            self.columns[f"{body.name}.q"] = slice(7*i + 3, 7*i + 7)
+
+        capacity = max(int(capacity), 1)
+        if path is None:
+            self._data = np.empty((capacity, self.width))
+        else:
+            self._data = npformat.open_memmap(path, mode="w+", dtype=float, shape=(capacity, self.width))
+
+    @classmethod
+    def load(cls, path: str, sys: MultibodySystem, mmap: bool = True) -> "Trajectory":
+        """
+        Opens a stored trajectory of sys, as a read/write memmap or loaded into memory
+        """
+        traj = cls(sys, capacity=1)
+        traj.path = path if mmap else None
+        traj._data = np.load(path, mmap_mode="r+" if mmap else None)
+        if traj._data.shape[1] != traj.width:
+            raise RuntimeError("Stored trajectory does not match the system.")
+        traj.length = len(traj._data)
+        return traj
+
+    #%%
+    # Recording
+
+    def record(self) -> None:
+        """
+        Appends the current pose buffer of the system
+        """
+        self.append(self.sys.poses())
+
+    def append(self, poses: NDArray) -> None:
+        """
+        Appends one row, the full pose table (n_bodies, 7) or (width,)
+        """
+        self._reserve(self.length + 1)
+        self._data[self.length] = np.reshape(poses, -1)
+        self.length += 1
+
+    def extend(self, poses: NDArray) -> None:
+        """
+        Appends a block of rows, (k, n_bodies, 7) or (k, width)
+        """
+        poses = np.reshape(poses, (-1, self.width))
+        self._reserve(self.length + len(poses))
+        self._data[self.length:self.length + len(poses)] = poses
+        self.length += len(poses)
+
+    def _reserve(self, n: int) -> None:
+        capacity = len(self._data)
+        if n <= capacity:
+            return
+        capacity = max(capacity, 1)
+        while capacity < n:
+            capacity *= 2
+
+        if self.path is None:
+            data = np.empty((capacity, self.width))
+            data[:self.length] = self._data[:self.length]
+            self._data = data
+        else:
+            if isinstance(self._data, np.memmap):
+                self._data.flush()
+            self._data = None
+            _resizeNpy(self.path, (capacity, self.width))
+            self._data = npformat.open_memmap(self.path, mode="r+")
+
+    def flush(self) -> None:
+        """
+        Trims an on-disk store to the recorded rows so the file can be read with np.load
+        """
+        if self.path is None:
+            return
+        if isinstance(self._data, np.memmap):
+            self._data.flush()
+        self._data = None
+        _resizeNpy(self.path, (self.length, self.width))
+        # An empty file cannot be memory mapped, it is mapped again once rows are appended
+        self._data = npformat.open_memmap(self.path, mode="r+") if self.length else np.empty((0, self.width))
+
+    #%%
+    # Access
+
+    @property
+    def data(self) -> NDArray:
+        return self._data[:self.length]
+
+    @property
+    def states(self) -> NDArray:
+        """
+        (n, nState) view of the packed states
+        """
+        return self._data[:self.length, :self.nState]
+
+    @property
+    def poses(self) -> NDArray:
+        """
+        (n, n_bodies, 7) view of every body's pose, in compiled (free first) order
+        """
+        return self.data.reshape(self.length, self.nBodies, 7)
+
+    def column(self, name: str) -> NDArray:
+        """
+        View of a named column, e.g. "upright.r" is the (n, 3) position history of the upright
+        """
+        return self._data[:self.length, self.columns[name]]
+
+    def body(self, name: str) -> NDArray:
+        return self.column(name)
+
+    def framePositions(self, frames: list | None = None) -> NDArray:
+        """
+        (n, n_frames, 3) global positions of the frames at every recorded step
+        """
+        return self.sys.framePositions(self, frames)
+
+    def transformPoints(self, body: str, name: str, steps=None, chunkSize: int | None = None, dtype=np.float64):
+        """
+        Chunks of the global positions of a body's attached points, see MultibodySystem.transformPoints
+        """
+        return self.sys.transformPoints(self, self.sys.getBody(body), name, steps, chunkSize, dtype)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.column(key)
+        return self.states[key]
+
+    def __iter__(self):
+        return iter(self.states)
+
+    def __array__(self, dtype=None, copy=None) -> NDArray:
+        states = self.states
+        if dtype is not None:
+            return states.astype(dtype)
+        return states.copy() if copy else states
+
+
+def appendNpy(path: str, rows: NDArray) -> int:
+    """
+    Appends rows to a .npy file along its first axis, creating it on the first call
+    The rows are written at the end and only the header is rewritten, so the file is a valid .npy
+    (readable with np.load) after every append. Returns the number of rows in the file
+    """
+    rows = np.ascontiguousarray(rows)
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            npformat.write_array(f, rows)
+        return len(rows)
+
+    with open(path, "r+b") as f:
+        version = npformat.read_magic(f)
+        if version == (1, 0):
+            shape, _, dtype = npformat.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = npformat.read_array_header_2_0(f)
+        if rows.dtype != dtype or rows.shape[1:] != shape[1:]:
+            raise ValueError(f"Rows {rows.dtype} {rows.shape[1:]} do not match {path}, {dtype} {shape[1:]}")
+        offset = f.tell()
+        f.seek(offset + int(np.prod(shape)) * dtype.itemsize)
+        f.write(rows.tobytes())
+
+    shape = (shape[0] + len(rows),) + shape[1:]
+    _resizeNpy(path, shape)
+    return shape[0]
+
+
+def _resizeNpy(path: str, shape: tuple) -> None:
+    """
+    Rewrites the shape in a .npy header and resizes the file to match
+    numpy pads the header so the shape can grow without moving the data
+    """
+    with open(path, "r+b") as f:
+        version = npformat.read_magic(f)
+        if version == (1, 0):
+            _, fortran, dtype = npformat.read_array_header_1_0(f)
+        else:
+            _, fortran, dtype = npformat.read_array_header_2_0(f)
+        offset = f.tell()
+
+        f.seek(0)
+        header = {"descr": npformat.dtype_to_descr(dtype), "fortran_order": fortran, "shape": shape}
+        if version == (1, 0):
+            npformat.write_array_header_1_0(f, header)
+        else:
+            npformat.write_array_header_2_0(f, header)
+        if f.tell() != offset:
+            raise RuntimeError("Trajectory header no longer fits, the store cannot be resized in place.")
+
+        f.truncate(offset + int(np.prod(shape)) * dtype.itemsize)
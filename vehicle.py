@@ -0,0 +1,118 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from numpy.typing import NDArray
+from components import MultibodySystem, Body
+from suspension_util import readParams, mirrorHardpoints, addCorner
+from kinematicsSim import heave_motion
+from motion import chassisMotion, rackMotion
+from metrics import SuspensionMetrics
+from decomposition import DecomposedSolver
+from trajectory import Trajectory
+
+
+CORNERS = ("FL", "FR", "RL", "RR")
+
+
+#%%
+# Vehicle assembly
+
+def buildVehicle(front: str = "doubleWishboneParams.csv", rear: str | None = None, wheelbase: float = 60.0,
+                 files: dict | None = None, tire: bool = False, rack: bool = False) -> MultibodySystem:
+    """
+    Builds a car of four double wishbone corners on one chassis.
+
+    Every corner file is a left corner in its own coordinates like doubleWishboneParams.csv (x forward from
+    the axle, y outboard from the centerline). The right corners are mirrored and the rear corners moved
+    back by the wheelbase, so the chassis origin is on the centerline at the front axle.
+    Bodies and frames are named by corner, e.g. "FL.upright" and "RR.chasLowFor" (see addCorner).
+    The chassis is driven by heave_motion until it is given a profile, e.g. chassisMotion(roll=..., pivot=...)
+
+    :param front: Parameter file of the front corners
+    :param rear: Parameter file of the rear corners, defaults to the front one
+    :param files: {corner: file} overriding front / rear per corner
+    :param tire: Tire uprights held on the ground through their contact point
+    :param rack: The front tie rods on a driven "rack" body (see buildDoubleWishbone)
+    """
+    files = {"FL": front, "FR": front, "RL": rear or front, "RR": rear or front} | (files or {})
+
+    world = Body("world", [0,0,0], [1,0,0,0], free=False)
+    chassis = Body("chassis", [0,0,0], [1,0,0,0], free=False)
+    chassis.setMotion(heave_motion)
+    bodies = [world, chassis]
+
+    steering = None
+    if rack:
+        steering = Body("rack", [0,0,0], [1,0,0,0], free=False)
+        steering.setMotion(heave_motion)
+        bodies.append(steering)
+
+    sys = MultibodySystem()
+    sys.addBody(bodies)
+    for corner in CORNERS:
+        hardpoints, params = readParams(files[corner])
+        side = 1 if corner[1] == "L" else -1
+        if side < 0:
+            hardpoints = mirrorHardpoints(hardpoints)
+        if corner[0] == "R":
+            hardpoints = {name: p - [wheelbase, 0, 0] for name, p in hardpoints.items()}
+        addCorner(sys, world, chassis, hardpoints, params, prefix=f"{corner}.", side=side, tire=tire,
+                  rack=steering if corner[0] == "F" else None)
+
+    return sys
+
+
+def cornerMetrics(sys: MultibodySystem, params: dict, corner: str) -> SuspensionMetrics:
+    """
+    SuspensionMetrics of one corner of buildVehicle, params as read from its file
+    """
+    return SuspensionMetrics.fromParams(sys, params, prefix=f"{corner}.")
+
+
+def vehicleCenter(sys: MultibodySystem) -> NDArray:
+    """
+    Center of the wheel centers at the ground (z = 0) in chassis coordinates, the default roll / pitch pivot
+    """
+    centers = [sys.getFrame(f"{c}.wheelCenter", f"{c}.upright").r_local for c in CORNERS]
+    center = np.mean(centers, axis=0)
+    center[2] = 0
+    return center
+
+
+#%%
+# Chassis pose sweep
+
+def gridSweep(sys: MultibodySystem, heave=0.0, roll=0.0, pitch=0.0, pivot: NDArray | None = None,
+              solver: DecomposedSolver | None = None, executor=None) -> tuple:
+    """
+    Solves the car at every chassis pose of the heave x roll x pitch grid (roll and pitch in degrees)
+
+    Every corner is an independent block of the constraint graph. The corners of every grid point are
+    stacked into one batched solve per corner (see DecomposedSolver.solveBatch) and the four corners are
+    solved concurrently on a thread pool, so the sweep takes about as long as one corner's.
+    Every point starts from the current configuration. A rack, if any, is carried by the chassis at zero steer.
+
+    :param pivot: Roll / pitch center in chassis coordinates, defaults to vehicleCenter
+    :param solver: DecomposedSolver of sys, defaults to one on its own thread pool of a thread per corner
+    :param executor: Executor of the default solver instead of the thread pool
+    :return: (trajectory, shape), one row per grid point in np.meshgrid(heave, roll, pitch, indexing="ij")
+             order, and the grid shape
+    """
+    if solver is None and executor is None:
+        with ThreadPoolExecutor(len(CORNERS)) as pool:
+            return gridSweep(sys, heave, roll, pitch, pivot, executor=pool)
+
+    compiled = sys._compiled()
+    solver = solver or DecomposedSolver(sys, executor=executor)
+    pivot = vehicleCenter(sys) if pivot is None else pivot
+
+    grid = np.meshgrid(np.atleast_1d(heave), np.atleast_1d(roll), np.atleast_1d(pitch), indexing="ij")
+    profile = chassisMotion(heave=grid[0].ravel(), roll=grid[1].ravel(), pitch=grid[2].ravel(), pivot=pivot)
+
+    poses = np.repeat(compiled.buffer[None], len(profile), axis=0)
+    poses[:,compiled.bodyIndex[sys.getBody("chassis")]] = profile.poses
+    if "rack" in [b.name for b in sys.bodies]:
+        poses[:,compiled.bodyIndex[sys.getBody("rack")]] = rackMotion(0.0, chassis=profile).poses
+
+    hist = Trajectory(sys, capacity=len(poses))
+    hist.extend(solver.solveBatch(poses))
+    return hist, grid[0].shape